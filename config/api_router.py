@@ -1,7 +1,14 @@
 from django.conf import settings
+from django.urls import path
 from rest_framework.routers import DefaultRouter, SimpleRouter
 
-from notification_service.app.views import ClientViewSet, MailingViewSet, MessageViewSet
+from notification_service.app.views import (
+    ClientBulkView,
+    ClientImportView,
+    ClientViewSet,
+    MailingViewSet,
+    MessageViewSet,
+)
 from notification_service.users.api.views import UserViewSet
 
 if settings.DEBUG:
@@ -15,4 +22,8 @@ router.register("mailings", MailingViewSet)
 router.register("messages", MessageViewSet)
 
 app_name = "api"
-urlpatterns = router.urls
+# Go before the router urls, which would take "bulk" or "import" for a client id
+urlpatterns = [
+    path("clients/bulk/", ClientBulkView.as_view(), name="client-bulk"),
+    path("clients/import/", ClientImportView.as_view(), name="client-import-clients"),
+] + router.urls
@@ -310,6 +310,11 @@ REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [],
     "DEFAULT_PERMISSION_CLASSES": ("rest_framework.permissions.AllowAny",),
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
+    "DEFAULT_PAGINATION_CLASS": "notification_service.utils.pagination.IdCursorPagination",
+    "PAGE_SIZE": 100,
+    "DEFAULT_FILTER_BACKENDS": [
+        "notification_service.utils.filters.QueryParamsFilterBackend"
+    ],
 }
 
 # django-cors-headers - https://github.com/adamchainz/django-cors-headers#setup
@@ -326,3 +331,61 @@ SPECTACULAR_SETTINGS = {
 
 # Project logic specific settings
 MAILING_SERVICE_TOKEN = env("MAILING_SERVICE_TOKEN", default="")
+MAILING_SWEEP_INTERVAL = env.int("MAILING_SWEEP_INTERVAL", default=60)
+MAILING_SENDER_INTERVAL = env.int("MAILING_SENDER_INTERVAL", default=10)
+MAILING_START_SCHEDULE_HORIZON = env.int("MAILING_START_SCHEDULE_HORIZON", default=3600)
+MAILING_TASK_LOCK_REDIS_URL = env("MAILING_TASK_LOCK_REDIS_URL", default="")
+MAILING_TASK_LEASE_TTL = env.int("MAILING_TASK_LEASE_TTL", default=30)
+MAILING_SENDER_MAX_RUNS = env.int("MAILING_SENDER_MAX_RUNS", default=2)
+MAILING_SENDER_PARTITIONS = env.int("MAILING_SENDER_PARTITIONS", default=1)
+MAILING_FANOUT_CHUNK_SIZE = env.int("MAILING_FANOUT_CHUNK_SIZE", default=10000)
+MAILING_SENDER_CLAIM_LEASE = env.int("MAILING_SENDER_CLAIM_LEASE", default=300)
+MAILING_SENDER_BATCH_SIZE = env.int("MAILING_SENDER_BATCH_SIZE", default=200)
+MAILING_SENDER_PIPELINED = env.bool("MAILING_SENDER_PIPELINED", default=False)
+MAILING_SENDER_CONCURRENCY = env.int("MAILING_SENDER_CONCURRENCY", default=10)
+MAILING_SENDER_FLUSH_SIZE = env.int("MAILING_SENDER_FLUSH_SIZE", default=200)
+MAILING_SENDER_FLUSH_INTERVAL = env.float("MAILING_SENDER_FLUSH_INTERVAL", default=1.0)
+MAILING_SENDER_BATCH_DEADLINE = env.float("MAILING_SENDER_BATCH_DEADLINE", default=30)
+MAILING_SENDER_RUN_TIME_BUDGET = env.float("MAILING_SENDER_RUN_TIME_BUDGET", default=20)
+MAILING_SENDER_AUTOTUNE = env.bool("MAILING_SENDER_AUTOTUNE", default=False)
+MAILING_SENDER_AUTOTUNE_TARGET_LATENCY = env.float(
+    "MAILING_SENDER_AUTOTUNE_TARGET_LATENCY", default=0.5
+)
+MAILING_SENDER_AUTOTUNE_MAX_SIZE = env.int(
+    "MAILING_SENDER_AUTOTUNE_MAX_SIZE", default=2000
+)
+MAILING_RETRY_MAX_ATTEMPTS = env.int("MAILING_RETRY_MAX_ATTEMPTS", default=5)
+MAILING_RETRY_BASE_DELAY = env.int("MAILING_RETRY_BASE_DELAY", default=30)
+MAILING_RETRY_MAX_DELAY = env.int("MAILING_RETRY_MAX_DELAY", default=3600)
+MAILING_RETRY_JITTER = env.float("MAILING_RETRY_JITTER", default=0.5)
+MAILING_CLIENT_MAX_CONNECTIONS = env.int("MAILING_CLIENT_MAX_CONNECTIONS", default=100)
+MAILING_CLIENT_MAX_KEEPALIVE_CONNECTIONS = env.int(
+    "MAILING_CLIENT_MAX_KEEPALIVE_CONNECTIONS", default=20
+)
+MAILING_CLIENT_KEEPALIVE_EXPIRY = env.float(
+    "MAILING_CLIENT_KEEPALIVE_EXPIRY", default=30.0
+)
+MAILING_CLIENT_CONNECT_TIMEOUT = env.float("MAILING_CLIENT_CONNECT_TIMEOUT", default=5)
+MAILING_CLIENT_READ_TIMEOUT = env.float("MAILING_CLIENT_READ_TIMEOUT", default=10)
+MAILING_CLIENT_POOL_TIMEOUT = env.float("MAILING_CLIENT_POOL_TIMEOUT", default=10)
+MAILING_CLIENT_HTTP2 = env.bool("MAILING_CLIENT_HTTP2", default=False)
+MAILING_CLIENT_ADAPTIVE_CONCURRENCY = env.bool(
+    "MAILING_CLIENT_ADAPTIVE_CONCURRENCY", default=False
+)
+MAILING_CLIENT_INITIAL_CONCURRENCY = env.int(
+    "MAILING_CLIENT_INITIAL_CONCURRENCY", default=10
+)
+MAILING_CLIENT_MAX_CONCURRENCY = env.int("MAILING_CLIENT_MAX_CONCURRENCY", default=100)
+MAILING_STATS_CACHE_TTL = env.int("MAILING_STATS_CACHE_TTL", default=5)
+MAILING_STATS_CACHE_LOCK_TIMEOUT = env.int(
+    "MAILING_STATS_CACHE_LOCK_TIMEOUT", default=10
+)
+CLIENT_BULK_MUTATION_CHUNK_SIZE = env.int(
+    "CLIENT_BULK_MUTATION_CHUNK_SIZE", default=1000
+)
+MAILING_RATE_LIMIT = env.float("MAILING_RATE_LIMIT", default=10)
+MAILING_RATE_LIMIT_PERIOD = env.float("MAILING_RATE_LIMIT_PERIOD", default=1)
+MAILING_RATE_LIMITER_REDIS_URL = env("MAILING_RATE_LIMITER_REDIS_URL", default="")
+MAILING_RATE_LIMIT_BY_OPERATOR = env.bool(
+    "MAILING_RATE_LIMIT_BY_OPERATOR", default=False
+)
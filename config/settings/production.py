@@ -19,6 +19,11 @@ ALLOWED_HOSTS = env.list("DJANGO_ALLOWED_HOSTS", default=["example.com"])
 # DATABASES
 # ------------------------------------------------------------------------------
 DATABASES["default"]["CONN_MAX_AGE"] = env.int("CONN_MAX_AGE", default=60)  # noqa F405
+# Required behind pgbouncer in transaction pooling mode
+# https://docs.djangoproject.com/en/dev/ref/databases/#transaction-pooling-server-side-cursors
+DATABASES["default"]["DISABLE_SERVER_SIDE_CURSORS"] = env.bool(  # noqa F405
+    "DISABLE_SERVER_SIDE_CURSORS", default=False
+)
 
 # CACHES
 # ------------------------------------------------------------------------------
@@ -0,0 +1,87 @@
+import csv
+import zlib
+from collections.abc import Iterable, Iterator
+from datetime import datetime
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Message
+
+EXPORT_FIELDS = {
+    "id": "id",
+    "client": "client_id",
+    "phone_number": "client__phone_number",
+    "status": "status",
+    "attempts": "attempts",
+    "created_at": "created_at",
+    "sent_at": "sent_at",
+}
+EXPORT_CHUNK_SIZE = 2000
+
+
+def iter_mailing_messages(
+    mailing_id: int, chunk_size: int = EXPORT_CHUNK_SIZE
+) -> Iterator[tuple]:
+    # The rows are read by keyset pages of ids, so the memory use does not
+    # depend on the size of the mailing. Unlike a server-side cursor, no
+    # cursor or transaction is held open while the response is streamed,
+    # which also works behind pgbouncer in transaction pooling mode.
+    messages_qs = (
+        Message.objects.filter(mailing_id=mailing_id)
+        .order_by("id")
+        .values_list(*EXPORT_FIELDS.values())
+    )
+    last_message_id = 0
+    while rows := list(messages_qs.filter(id__gt=last_message_id)[:chunk_size]):
+        yield from rows
+        last_message_id = rows[-1][0]
+
+
+class _Echo:
+    def write(self, value: str) -> str:
+        return value
+
+
+def render_ndjson(rows: Iterable[tuple]) -> Iterator[str]:
+    encoder = DjangoJSONEncoder()
+    for row in rows:
+        yield encoder.encode(dict(zip(EXPORT_FIELDS, row))) + "\n"
+
+
+def render_csv(rows: Iterable[tuple]) -> Iterator[str]:
+    # Datetimes are formatted the same way as in the JSON responses
+    encoder = DjangoJSONEncoder()
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow(
+            [
+                encoder.default(value) if isinstance(value, datetime) else value
+                for value in row
+            ]
+        )
+
+
+def encode_chunks(lines: Iterable[str], compress: bool = False) -> Iterator[bytes]:
+    # Lines are sent in chunks of about 64KB instead of one by one
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if compress else None
+    buffer, buffer_size = [], 0
+    for line in lines:
+        buffer.append(line)
+        buffer_size += len(line)
+        if buffer_size >= 64 * 1024:
+            chunk = "".join(buffer).encode()
+            yield compressor.compress(chunk) if compressor else chunk
+            buffer, buffer_size = [], 0
+
+    chunk = "".join(buffer).encode()
+    if compressor:
+        yield compressor.compress(chunk) + compressor.flush()
+    elif chunk:
+        yield chunk
+
+
+RENDERERS = {
+    "ndjson": (render_ndjson, "application/x-ndjson"),
+    "csv": (render_csv, "text/csv"),
+}
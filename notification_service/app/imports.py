@@ -0,0 +1,254 @@
+import codecs
+import csv
+import io
+import json
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass, field
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from more_itertools import chunked
+
+from .models import TIMEZONES, Client
+
+IMPORT_FIELDS = ("phone_number", "mobile_operator_code", "tag", "timezone")
+IMPORT_BATCH_SIZE = 10000
+MAX_REPORTED_ERRORS = 1000
+
+_VALID_TIMEZONES = frozenset(timezone for timezone, _ in TIMEZONES)
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+def iter_json_array(stream, chunk_size: int = 64 * 1024) -> Iterator:
+    # Decodes the items of a top level JSON array one by one, reading the
+    # stream in chunks instead of loading the whole document
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer, position, started, exhausted = "", 0, False, False
+
+    def skip(characters: str) -> int:
+        nonlocal position
+        while position < len(buffer) and buffer[position] in characters:
+            position += 1
+        return position
+
+    while True:
+        skip(" \t\r\n," if started else " \t\r\n")
+        if position < len(buffer):
+            if not started:
+                if buffer[position] != "[":
+                    raise ImportFormatError("A JSON array is expected")
+                started = True
+                position += 1
+                continue
+            if buffer[position] == "]":
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as e:
+                if exhausted:
+                    raise ImportFormatError(f"Invalid JSON: {e}")
+            else:
+                yield item
+                continue
+        if exhausted:
+            raise ImportFormatError("Unexpected end of the JSON array")
+        chunk = stream.read(chunk_size)
+        exhausted = not chunk
+        buffer = buffer[position:] + text_decoder.decode(chunk, final=exhausted)
+        position = 0
+
+
+def iter_lines(stream, chunk_size: int = 64 * 1024) -> Iterator[str]:
+    # The readline() of the request streams buffers the rest of the body
+    # and copies it on every call, so the lines are split here
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    tail = ""
+    while chunk := stream.read(chunk_size):
+        lines = (tail + text_decoder.decode(chunk)).split("\n")
+        tail = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    if tail := tail + text_decoder.decode(b"", final=True):
+        yield tail
+
+
+def iter_ndjson(stream) -> Iterator:
+    for line_number, line in enumerate(iter_lines(stream), 1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ImportFormatError(f"Invalid JSON in line {line_number}: {e}")
+
+
+def iter_csv(stream) -> Iterator:
+    return csv.DictReader(iter_lines(stream))
+
+
+READERS: dict[str, Callable[..., Iterator]] = {
+    "application/json": iter_json_array,
+    "application/x-ndjson": iter_ndjson,
+    "text/csv": iter_csv,
+}
+
+
+_MODEL_FIELDS = {model_field.name: model_field for model_field in Client._meta.fields}
+_FIELD_VALIDATORS = [
+    (field_name, model_field.get_default() or None, tuple(model_field.validators))
+    for field_name in IMPORT_FIELDS
+    for model_field in [_MODEL_FIELDS[field_name]]
+]
+
+
+def validate_client_row(row) -> tuple[tuple | None, dict[str, list[str]]]:
+    # A lightweight equivalent of the ClientSerializer validation, cheap
+    # enough for millions of rows
+    if not isinstance(row, dict):
+        return None, {"non_field_errors": ["An object is expected"]}
+
+    values, errors = [], {}
+    for field_name, default, validators in _FIELD_VALIDATORS:
+        value = row.get(field_name) or default
+        if not isinstance(value, str):
+            errors[field_name] = ["This field is required and must be a string."]
+            continue
+        try:
+            for validator in validators:
+                validator(value)
+        except ValidationError as e:
+            errors[field_name] = e.messages
+            continue
+        if field_name == "timezone" and value not in _VALID_TIMEZONES:
+            errors[field_name] = [f'"{value}" is not a valid timezone.']
+            continue
+        values.append(value)
+    return (None if errors else tuple(values)), errors
+
+
+@dataclass
+class ClientImportResult:
+    created: int = 0
+    updated: int = 0
+    errors_count: int = 0
+    row_errors: list[dict] = field(default_factory=list)
+    # Set when the body turned out malformed, the rows before are imported
+    format_error: str | None = None
+
+
+class ClientImporter:
+    # Validates the rows as they are read and writes the valid ones in
+    # batches: COPY on PostgreSQL, bulk_create() elsewhere. With `upsert`,
+    # the clients with an already known phone number are updated instead.
+    # Every batch is a transaction of its own.
+
+    def __init__(self, upsert: bool = False, batch_size: int = IMPORT_BATCH_SIZE):
+        self.upsert = upsert
+        self.batch_size = batch_size
+
+    def _iter_valid_rows(
+        self, rows: Iterable, result: ClientImportResult
+    ) -> Iterator[tuple]:
+        try:
+            for row_number, row in enumerate(rows, 1):
+                values, errors = validate_client_row(row)
+                if values is None:
+                    result.errors_count += 1
+                    if len(result.row_errors) < MAX_REPORTED_ERRORS:
+                        result.row_errors.append(
+                            {"row": row_number, "field_errors": errors}
+                        )
+                else:
+                    yield values
+        except ImportFormatError as e:
+            result.format_error = str(e)
+
+    @staticmethod
+    def _copy(cursor, table: str, batch: list[tuple]):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(batch)
+        buffer.seek(0)
+        cursor.copy_expert(
+            f"COPY {table} ({', '.join(IMPORT_FIELDS)}) FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+
+    @transaction.atomic()
+    def _write_batch_copy(self, batch: list[tuple], result: ClientImportResult):
+        table = Client._meta.db_table
+        with connection.cursor() as cursor:
+            if not self.upsert:
+                self._copy(cursor, table, batch)
+                result.created += len(batch)
+                return
+
+            cursor.execute(
+                "CREATE TEMPORARY TABLE client_import "
+                f"(LIKE {table} INCLUDING DEFAULTS)"
+            )
+            self._copy(cursor, "client_import", batch)
+            # Without the statistics the planner expects a tiny temporary
+            # table and may pick nested loops over the whole client table
+            cursor.execute("ANALYZE client_import")
+            cursor.execute(
+                f"UPDATE {table} AS client SET "
+                "mobile_operator_code = client_import.mobile_operator_code, "
+                "tag = client_import.tag, timezone = client_import.timezone "
+                "FROM client_import "
+                "WHERE client.phone_number = client_import.phone_number"
+            )
+            result.updated += cursor.rowcount
+            cursor.execute(
+                f"INSERT INTO {table} ({', '.join(IMPORT_FIELDS)}) "
+                f"SELECT {', '.join(IMPORT_FIELDS)} FROM client_import "
+                f"WHERE NOT EXISTS (SELECT FROM {table} AS client "
+                "WHERE client.phone_number = client_import.phone_number)"
+            )
+            result.created += cursor.rowcount
+            cursor.execute("DROP TABLE client_import")
+
+    @transaction.atomic()
+    def _write_batch_orm(self, batch: list[tuple], result: ClientImportResult):
+        clients = [Client(**dict(zip(IMPORT_FIELDS, values))) for values in batch]
+        if self.upsert:
+            existing_clients: dict[str, list[Client]] = {}
+            for client in Client.objects.filter(
+                phone_number__in=[client.phone_number for client in clients]
+            ):
+                existing_clients.setdefault(client.phone_number, []).append(client)
+            updated_clients = []
+            for client in clients:
+                for existing_client in existing_clients.get(client.phone_number, []):
+                    existing_client.mobile_operator_code = client.mobile_operator_code
+                    existing_client.tag = client.tag
+                    existing_client.timezone = client.timezone
+                    updated_clients.append(existing_client)
+            Client.objects.bulk_update(
+                updated_clients, ["mobile_operator_code", "tag", "timezone"]
+            )
+            result.updated += len(updated_clients)
+            clients = [
+                client
+                for client in clients
+                if client.phone_number not in existing_clients
+            ]
+        Client.objects.bulk_create(clients)
+        result.created += len(clients)
+
+    def execute(self, rows: Iterable) -> ClientImportResult:
+        result = ClientImportResult()
+        write_batch = (
+            self._write_batch_copy
+            if connection.vendor == "postgresql"
+            else self._write_batch_orm
+        )
+        for batch in chunked(self._iter_valid_rows(rows, result), self.batch_size):
+            if self.upsert:
+                # The last row of a phone number wins
+                batch = list({values[0]: values for values in batch}.values())
+            write_batch(batch, result)
+        return result
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from django_celery_beat.models import IntervalSchedule, PeriodicTask, PeriodicTasks
 
@@ -7,20 +8,29 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         IntervalSchedule.objects.all().delete()
-        schedule, _ = IntervalSchedule.objects.get_or_create(
-            every=10,
+        sweep_schedule, _ = IntervalSchedule.objects.get_or_create(
+            every=settings.MAILING_SWEEP_INTERVAL,
+            period=IntervalSchedule.SECONDS,
+        )
+        # The sender picks up the due retries and the opened send windows,
+        # so it runs more often than the mailings start sweep
+        sender_schedule, _ = IntervalSchedule.objects.get_or_create(
+            every=settings.MAILING_SENDER_INTERVAL,
             period=IntervalSchedule.SECONDS,
         )
 
         task, _ = PeriodicTask.objects.get_or_create(
             name="Start upcoming mailings",
             task="notification_service.app.tasks.start_upcoming_mailings",
-            interval=schedule,
+            interval=sweep_schedule,
+            # Ticks not picked up before the next one are dropped
+            defaults={"expire_seconds": settings.MAILING_SWEEP_INTERVAL},
         )
         PeriodicTasks.changed(task)
         task, _ = PeriodicTask.objects.get_or_create(
             name="Send upcoming messages",
             task="notification_service.app.tasks.send_upcoming_messages",
-            interval=schedule,
+            interval=sender_schedule,
+            defaults={"expire_seconds": settings.MAILING_SENDER_INTERVAL},
         )
         PeriodicTasks.changed(task)
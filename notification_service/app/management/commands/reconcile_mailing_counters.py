@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from notification_service.app.models import MailingStatusCounter
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the mailing status counters from the messages"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "mailing_ids",
+            nargs="*",
+            type=int,
+            help="Mailings to rebuild the counters of, all by default",
+        )
+
+    def handle(self, *args, **options):
+        MailingStatusCounter.objects.rebuild(mailing_ids=options["mailing_ids"] or None)
+        self.stdout.write("Mailing status counters are rebuilt")
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.8 on 2026-10-18 10:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_alter_client_phone_number'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailing',
+            name='fanout_cursor',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
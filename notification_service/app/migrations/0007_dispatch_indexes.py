@@ -0,0 +1,36 @@
+# Generated by Django 4.0.8 on 2026-10-18 10:26
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('app', '0006_mailing_fanout_cursor'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='client',
+            index=models.Index(fields=['mobile_operator_code', 'tag', 'id'], name='client_operator_tag_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='client',
+            index=models.Index(fields=['tag', 'id'], name='client_tag_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='mailing',
+            index=models.Index(condition=models.Q(('started_at', None)), fields=['start_at', 'finish_at'], name='mailing_not_started_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(condition=models.Q(('status__in', ['Pending', 'Failed'])), fields=['id'], name='message_dispatch_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(condition=models.Q(('status', 'Pending')), fields=['mailing'], name='message_pending_mailing_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.0.8 on 2026-10-18 10:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_message_claimed_until'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='status',
+            field=models.TextField(choices=[('Pending', 'Pending'), ('Succeed', 'Succeed'), ('Failed', 'Failed'), ('Canceled', 'Canceled'), ('Undelivered', 'Undelivered')]),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.0.8 on 2026-10-18 10:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_message_retries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailingStatusCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.TextField(choices=[('Pending', 'Pending'), ('Succeed', 'Succeed'), ('Failed', 'Failed'), ('Canceled', 'Canceled'), ('Undelivered', 'Undelivered')])),
+                ('count', models.BigIntegerField(default=0)),
+                ('mailing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.mailing')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='mailingstatuscounter',
+            constraint=models.UniqueConstraint(fields=('mailing', 'status'), name='mailing_status_counter_unique'),
+        ),
+        migrations.RunSQL(
+            sql=(
+                "INSERT INTO app_mailingstatuscounter (mailing_id, status, count) "
+                "SELECT mailing_id, status, COUNT(*) FROM app_message "
+                "GROUP BY mailing_id, status"
+            ),
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
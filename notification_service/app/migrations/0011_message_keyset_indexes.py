@@ -0,0 +1,24 @@
+# Generated by Django 4.0.8 on 2026-10-18 10:58
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('app', '0010_mailing_status_counter'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(fields=['mailing', 'id'], name='message_mailing_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(fields=['client', 'id'], name='message_client_id_idx'),
+        ),
+    ]
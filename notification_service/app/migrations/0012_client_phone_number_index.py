@@ -0,0 +1,20 @@
+# Generated by Django 4.0.8 on 2026-10-18 11:06
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('app', '0011_message_keyset_indexes'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='client',
+            index=models.Index(fields=['phone_number'], name='client_phone_number_idx'),
+        ),
+    ]
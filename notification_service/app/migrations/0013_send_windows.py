@@ -0,0 +1,40 @@
+# Generated by Django 4.0.8 on 2026-10-18 11:34
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('app', '0012_client_phone_number_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailing',
+            name='send_window_end',
+            field=models.TimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mailing',
+            name='send_window_start',
+            field=models.TimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='eligible_from',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='eligible_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(condition=models.Q(('status__in', ['Pending', 'Failed']), ('eligible_until__isnull', False)), fields=['eligible_until'], name='message_send_window_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.8 on 2026-10-18 11:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_send_windows'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailing',
+            name='scheduled_start_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,9 +1,13 @@
-from collections import OrderedDict
+from collections import Counter, OrderedDict
+from datetime import time
 
 import pytz
 from django.core.validators import RegexValidator
-from django.db import models
-from django.db.models import Count, QuerySet
+from django.db import connections, models, transaction
+from django.db.models import QuerySet, Sum
+from django.db.models.sql import DeleteQuery, UpdateQuery
+
+from .stats_cache import invalidate_mailing_stats
 
 TIMEZONES = tuple(zip(pytz.all_timezones, pytz.all_timezones))
 
@@ -11,9 +15,9 @@ TIMEZONES = tuple(zip(pytz.all_timezones, pytz.all_timezones))
 class MailingQuerySet(QuerySet):
     def stats(self) -> dict["Message.Status", int]:
         stats_qs = (
-            Message.objects.filter(mailing__in=self)
+            MailingStatusCounter.objects.filter(mailing__in=self)
             .values("status")
-            .annotate(count=Count("status"))
+            .annotate(count=Sum("count"))
         )
         result = OrderedDict([(val, 0) for val in Message.Status.values])
         for stat in stats_qs:
@@ -25,13 +29,38 @@ class MailingQuerySet(QuerySet):
 class Mailing(models.Model):
     start_at = models.DateTimeField(blank=False, null=False)
     started_at = models.DateTimeField(blank=True, null=True)
+    # The start_at the start task is currently scheduled for
+    scheduled_start_at = models.DateTimeField(blank=True, null=True)
+    fanout_cursor = models.BigIntegerField(blank=True, null=True)
     finish_at = models.DateTimeField(blank=True, null=True)
     content = models.TextField(null=False)
     mobile_operator_code = models.CharField(max_length=3, null=True)
     tag = models.CharField(max_length=50, null=True)
+    # Local time of the clients the messages are sent within, if set
+    send_window_start = models.TimeField(blank=True, null=True)
+    send_window_end = models.TimeField(blank=True, null=True)
 
     objects = MailingQuerySet.as_manager()
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["start_at", "finish_at"],
+                condition=models.Q(started_at=None),
+                name="mailing_not_started_idx",
+            ),
+        ]
+
+    @property
+    def send_window(self) -> tuple[time, time] | None:
+        if self.send_window_start is None or self.send_window_end is None:
+            return None
+        return self.send_window_start, self.send_window_end
+
+    @property
+    def has_send_window(self) -> bool:
+        return self.send_window is not None
+
 
 class Client(models.Model):
     phone_number = models.CharField(
@@ -51,6 +80,84 @@ class Client(models.Model):
     tag = models.CharField(max_length=50)
     timezone = models.CharField(max_length=32, choices=TIMEZONES, default="UTC")
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["mobile_operator_code", "tag", "id"],
+                name="client_operator_tag_idx",
+            ),
+            models.Index(fields=["tag", "id"], name="client_tag_idx"),
+            # Matches the imported clients by phone number
+            models.Index(fields=["phone_number"], name="client_phone_number_idx"),
+        ]
+
+
+class MessageQuerySet(QuerySet):
+    def update(self, **kwargs) -> int:
+        # Status changes of any number of rows, bulk_update() included, are
+        # reflected in the mailing status counters: a single statement locks
+        # the rows and returns their statuses before and after the update,
+        # so rows committed concurrently are either counted or left alone.
+        if self.query.is_sliced:
+            raise TypeError("Cannot update a query once a slice has been taken.")
+        if "status" not in kwargs:
+            return super().update(**kwargs)
+
+        with transaction.atomic(using=self.db):
+            status_changes = self._update_returning_statuses(kwargs)
+            deltas: Counter = Counter()
+            for (mailing_id, previous_status, status), count in status_changes.items():
+                deltas[(mailing_id, status)] += count
+                deltas[(mailing_id, previous_status)] -= count
+            MailingStatusCounter.objects.add(deltas)
+        self._result_cache = None
+        return sum(status_changes.values())
+
+    def delete(self) -> tuple[int, dict[str, int]]:
+        # The deleted rows are subtracted from the counters the same way
+        if self.query.is_sliced:
+            raise TypeError("Cannot use 'limit' or 'offset' with delete().")
+        query = self.query.clone()
+        query.clear_ordering(True)
+        query.__class__ = DeleteQuery
+        delete_sql, params = query.get_compiler(self.db).as_sql()
+
+        with transaction.atomic(using=self.db):
+            deleted_counts = self._fetch_counts(
+                f"WITH deleted AS ({delete_sql} RETURNING mailing_id, status) "
+                "SELECT mailing_id, status, COUNT(*) FROM deleted "
+                "GROUP BY mailing_id, status",
+                params,
+            )
+            MailingStatusCounter.objects.add(
+                {key: -count for key, count in deleted_counts.items()}
+            )
+        self._result_cache = None
+        deleted_count = sum(deleted_counts.values())
+        return deleted_count, {self.model._meta.label: deleted_count}
+
+    def _update_returning_statuses(self, values: dict) -> Counter:
+        table = self.model._meta.db_table
+        locked_qs = self.select_for_update(of=("self",)).values("id", "status")
+        locked_sql, locked_params = locked_qs.query.sql_with_params()
+        query = UpdateQuery(self.model)
+        query.add_update_values(values)
+        update_sql, update_params = query.get_compiler(self.db).as_sql()
+        return self._fetch_counts(
+            f"WITH updated AS ({update_sql} FROM ({locked_sql}) AS previous "
+            f"WHERE {table}.id = previous.id "
+            f"RETURNING {table}.mailing_id, previous.status AS previous_status, "
+            f"{table}.status) "
+            "SELECT mailing_id, previous_status, status, COUNT(*) FROM updated "
+            "GROUP BY mailing_id, previous_status, status",
+            (*update_params, *locked_params),
+        )
+
+    def _fetch_counts(self, sql: str, params) -> Counter:
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            return Counter({tuple(row[:-1]): row[-1] for row in cursor})
+
 
 class Message(models.Model):
     class Status(models.TextChoices):
@@ -58,9 +165,134 @@ class Message(models.Model):
         SUCCEED = "Succeed"
         FAILED = "Failed"
         CANCELED = "Canceled"
+        UNDELIVERED = "Undelivered"
 
     created_at = models.DateTimeField(auto_now_add=True)
     sent_at = models.DateTimeField(null=True, blank=True)
+    claimed_until = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    # The send window of the mailing in the client's timezone, in UTC
+    eligible_from = models.DateTimeField(null=True, blank=True)
+    eligible_until = models.DateTimeField(null=True, blank=True)
     status = models.TextField(choices=Status.choices)
     mailing = models.ForeignKey(Mailing, on_delete=models.PROTECT)
     client = models.ForeignKey(Client, on_delete=models.PROTECT)
+
+    objects = MessageQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["id"],
+                condition=models.Q(status__in=["Pending", "Failed"]),
+                name="message_dispatch_idx",
+            ),
+            models.Index(
+                fields=["mailing"],
+                condition=models.Q(status="Pending"),
+                name="message_pending_mailing_idx",
+            ),
+            # Keyset pages of the messages of a mailing or a client
+            models.Index(fields=["mailing", "id"], name="message_mailing_id_idx"),
+            models.Index(fields=["client", "id"], name="message_client_id_idx"),
+            models.Index(
+                fields=["eligible_until"],
+                condition=models.Q(status__in=["Pending", "Failed"])
+                & models.Q(eligible_until__isnull=False),
+                name="message_send_window_idx",
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous_status = (
+                None
+                if self._state.adding
+                else Message.objects.select_for_update()
+                .filter(pk=self.pk)
+                .values_list("status", flat=True)
+                .first()
+            )
+            super().save(*args, **kwargs)
+            if previous_status != self.status:
+                deltas = Counter({(self.mailing_id, self.status): 1})
+                if previous_status is not None:
+                    deltas[(self.mailing_id, previous_status)] -= 1
+                MailingStatusCounter.objects.add(deltas)
+
+    def delete(self, *args, **kwargs) -> tuple[int, dict[str, int]]:
+        # Deleted through the queryset, which keeps the counters
+        if self.pk is None:
+            raise ValueError(
+                f"{self._meta.object_name} object can't be deleted because its "
+                f"{self._meta.pk.attname} attribute is set to None."
+            )
+        deleted = Message.objects.filter(pk=self.pk).delete()
+        self.pk = None
+        return deleted
+
+
+class MailingStatusCounterQuerySet(QuerySet):
+    def add(self, deltas: dict[tuple[int, str], int]):
+        # Sorted, so concurrent writers lock the counters in the same order
+        changes = sorted(item for item in deltas.items() if item[1])
+        if not changes:
+            return
+        table = MailingStatusCounter._meta.db_table
+        params: list[int | str] = []
+        for (mailing_id, status), count in changes:
+            params += [mailing_id, status, count]
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (mailing_id, status, count) VALUES "
+                + ", ".join(["(%s, %s, %s)"] * len(changes))
+                + " ON CONFLICT (mailing_id, status) DO UPDATE "
+                f"SET count = {table}.count + EXCLUDED.count",
+                params,
+            )
+        mailing_ids = {mailing_id for (mailing_id, _), _ in changes}
+        transaction.on_commit(
+            lambda: invalidate_mailing_stats(mailing_ids), using=self.db
+        )
+
+    def rebuild(self, mailing_ids: list[int] | None = None):
+        # Writers of the messages are blocked while the counters are rebuilt
+        table = MailingStatusCounter._meta.db_table
+        message_table = Message._meta.db_table
+        mailing_filter, params = "", []
+        if mailing_ids is not None:
+            mailing_filter, params = "WHERE mailing_id = ANY(%s)", [list(mailing_ids)]
+        with transaction.atomic(using=self.db), connections[self.db].cursor() as cursor:
+            cursor.execute(f"LOCK TABLE {message_table} IN SHARE MODE")
+            cursor.execute(f"DELETE FROM {table} {mailing_filter}", params)
+            cursor.execute(
+                f"INSERT INTO {table} (mailing_id, status, count) "
+                "SELECT mailing_id, status, COUNT(*) "
+                f"FROM {message_table} {mailing_filter} "
+                "GROUP BY mailing_id, status",
+                params,
+            )
+            rebuilt_ids = (
+                list(self.values_list("mailing_id", flat=True).distinct())
+                if mailing_ids is None
+                else mailing_ids
+            )
+            transaction.on_commit(
+                lambda: invalidate_mailing_stats(rebuilt_ids), using=self.db
+            )
+
+
+class MailingStatusCounter(models.Model):
+    mailing = models.ForeignKey(Mailing, on_delete=models.CASCADE)
+    status = models.TextField(choices=Message.Status.choices)
+    count = models.BigIntegerField(default=0)
+
+    objects = MailingStatusCounterQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["mailing", "status"], name="mailing_status_counter_unique"
+            ),
+        ]
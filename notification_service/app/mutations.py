@@ -0,0 +1,75 @@
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, QuerySet
+
+from .models import Client, Message
+
+MAX_REPORTED_BLOCKED_CLIENTS = 1000
+
+
+@dataclass
+class ClientBulkMutationResult:
+    matched: int = 0
+    updated: int = 0
+    deleted: int = 0
+    blocked: int = 0
+    blocked_ids: list[int] = field(default_factory=list)
+
+
+class ClientBulkMutation:
+    # Changes the clients of a queryset chunk by chunk, every chunk in its
+    # own short transaction, so the rows are not locked for the whole run.
+    # The clients are walked by id, a client is never visited twice even if
+    # the change makes it match the queryset again.
+
+    def __init__(self, queryset: QuerySet[Client], chunk_size: int | None = None):
+        self.queryset = queryset
+        self.chunk_size = chunk_size or settings.CLIENT_BULK_MUTATION_CHUNK_SIZE
+
+    def _iter_id_chunks(self):
+        last_id = 0
+        while ids := list(
+            self.queryset.filter(id__gt=last_id)
+            .order_by("id")
+            .values_list("id", flat=True)[: self.chunk_size]
+        ):
+            yield ids
+            last_id = ids[-1]
+
+    def update(self, values: dict) -> ClientBulkMutationResult:
+        result = ClientBulkMutationResult()
+        for ids in self._iter_id_chunks():
+            result.matched += len(ids)
+            with transaction.atomic():
+                result.updated += self.queryset.filter(id__in=ids).update(**values)
+        return result
+
+    def delete(self) -> ClientBulkMutationResult:
+        # Clients with messages are protected from deletion, they are skipped
+        # and reported instead of failing the whole run
+        result = ClientBulkMutationResult()
+        for ids in self._iter_id_chunks():
+            result.matched += len(ids)
+            with transaction.atomic():
+                # The locks keep new messages from referencing the clients
+                # until they are deleted
+                clients = Client.objects.filter(
+                    id__in=list(
+                        self.queryset.filter(id__in=ids)
+                        .select_for_update()
+                        .values_list("id", flat=True)
+                    )
+                )
+                blocked_ids = list(
+                    clients.filter(
+                        Exists(Message.objects.filter(client_id=OuterRef("id")))
+                    ).values_list("id", flat=True)
+                )
+                result.deleted += clients.exclude(id__in=blocked_ids).delete()[0]
+            result.blocked += len(blocked_ids)
+            result.blocked_ids += blocked_ids[
+                : MAX_REPORTED_BLOCKED_CLIENTS - len(result.blocked_ids)
+            ]
+        return result
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+
+from notification_service.utils.batch_size_tuner import AdaptiveBatchSize
+from notification_service.utils.mailing_client import MailingMessage
+
+_STOP = None
+
+
+class MessageSendingPipeline:
+    # Streams messages through three concurrent stages connected by bounded
+    # queues: a reader claiming message batches, a pool of senders posting
+    # them and a writer flushing the results by size or by time.
+
+    def __init__(
+        self,
+        read_batches: Callable[[], AsyncIterator[list[MailingMessage]]],
+        post_message: Callable[[MailingMessage], Awaitable],
+        write_results: Callable[[list[MailingMessage]], Awaitable],
+        concurrency: int = 10,
+        queue_size: int = 1000,
+        flush_size: int = 200,
+        flush_interval: float = 1.0,
+        stats_interval: float = 10.0,
+        post_deadline: float | None = None,
+        flush_size_tuner: AdaptiveBatchSize | None = None,
+        post_until: float | None = None,
+    ):
+        self.read_batches = read_batches
+        self.post_message = post_message
+        self.write_results = write_results
+        self.concurrency = concurrency
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.stats_interval = stats_interval
+        self.post_deadline = post_deadline
+        self.flush_size_tuner = flush_size_tuner
+        # The `time.monotonic()` after which the queued messages are passed
+        # to the writer unposted, so the pipeline drains in a bounded time
+        self.post_until = post_until
+
+        self._send_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._write_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.read_count = 0
+        self.sent_count = 0
+        self.skipped_count = 0
+        self.timed_out_count = 0
+        self.written_count = 0
+
+    def queue_depths(self) -> dict[str, int]:
+        return {
+            "send": self._send_queue.qsize(),
+            "write": self._write_queue.qsize(),
+        }
+
+    def get_flush_size(self) -> int:
+        if self.flush_size_tuner:
+            return self.flush_size_tuner.size
+        return self.flush_size
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "read": self.read_count,
+            "sent": self.sent_count,
+            "skipped": self.skipped_count,
+            "timed_out": self.timed_out_count,
+            "written": self.written_count,
+            "flush_size": self.get_flush_size(),
+            **{
+                f"{stage}_queue_depth": depth
+                for stage, depth in self.queue_depths().items()
+            },
+        }
+
+    async def _read(self):
+        async for messages in self.read_batches():
+            for message in messages:
+                await self._send_queue.put(message)
+                self.read_count += 1
+        for _ in range(self.concurrency):
+            await self._send_queue.put(_STOP)
+
+    def _get_post_timeout(self) -> float | None:
+        if self.post_until is None:
+            return self.post_deadline
+        time_left = self.post_until - time.monotonic()
+        if self.post_deadline is None:
+            return time_left
+        return min(self.post_deadline, time_left)
+
+    async def _send(self):
+        while (message := await self._send_queue.get()) is not _STOP:
+            timeout = self._get_post_timeout()
+            if timeout is not None and timeout <= 0:
+                # Left PENDING like a cancelled post
+                self.skipped_count += 1
+            else:
+                try:
+                    await asyncio.wait_for(self.post_message(message), timeout)
+                except asyncio.TimeoutError:
+                    # The message stays PENDING and is written back as unsent
+                    logging.warning("Cancelled a message post exceeding the deadline")
+                    self.timed_out_count += 1
+                else:
+                    self.sent_count += 1
+            await self._write_queue.put(message)
+
+    async def _write(self):
+        loop = asyncio.get_running_loop()
+        buffer: list[MailingMessage] = []
+        flush_at = loop.time() + self.flush_interval
+        while True:
+            try:
+                message = await asyncio.wait_for(
+                    self._write_queue.get(), max(flush_at - loop.time(), 0)
+                )
+            except asyncio.TimeoutError:
+                pass
+            else:
+                if message is _STOP:
+                    break
+                buffer.append(message)
+
+            if len(buffer) >= self.get_flush_size() or loop.time() >= flush_at:
+                await self._flush(buffer)
+                buffer = []
+                flush_at = loop.time() + self.flush_interval
+
+        await self._flush(buffer)
+
+    async def _flush(self, messages: list[MailingMessage]):
+        if messages:
+            started_at = time.monotonic()
+            await self.write_results(messages)
+            if self.flush_size_tuner:
+                self.flush_size_tuner.observe(
+                    len(messages), time.monotonic() - started_at
+                )
+            self.written_count += len(messages)
+
+    async def _report_stats(self):
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            logging.info("Message sending pipeline stats: %s", self.stats())
+
+    async def _run_senders(self):
+        await asyncio.gather(*[self._send() for _ in range(self.concurrency)])
+        await self._write_queue.put(_STOP)
+
+    async def run(self):
+        stats_reporter = asyncio.ensure_future(self._report_stats())
+        reader, senders, writer = stages = [
+            asyncio.ensure_future(stage)
+            for stage in (self._read(), self._run_senders(), self._write())
+        ]
+        try:
+            await asyncio.gather(*stages)
+        finally:
+            for task in (reader, senders, stats_reporter):
+                task.cancel()
+            await asyncio.gather(
+                reader, senders, stats_reporter, return_exceptions=True
+            )
+            # The writer is stopped rather than cancelled, so the results
+            # already posted are persisted even when another stage failed
+            if not writer.done():
+                await self._write_queue.put(_STOP)
+            await asyncio.gather(writer, return_exceptions=True)
+            logging.info("Message sending pipeline finished: %s", self.stats())
@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta
+
+from django.db.models import (
+    DateTimeField,
+    ExpressionWrapper,
+    F,
+    FloatField,
+    Func,
+    Value,
+)
+from django.db.models.functions import Least, Power
+
+
+class RetryPolicy:
+    # Exponential backoff with jitter: the n-th failed attempt delays the
+    # next one by base_delay * 2 ** (n - 1), capped by max_delay and
+    # shortened by up to `jitter` of it at random.
+
+    def __init__(
+        self,
+        max_attempts: int = 5,
+        base_delay: timedelta = timedelta(seconds=30),
+        max_delay: timedelta = timedelta(hours=1),
+        jitter: float = 0.5,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def next_attempt_at_expression(self, now: datetime, attempts_field: str):
+        # Computed in SQL for set-based updates, `attempts_field` holding the
+        # number of attempts made before the failed one
+        delay_seconds = Least(
+            Value(self.base_delay.total_seconds()) * Power(2.0, F(attempts_field)),
+            Value(self.max_delay.total_seconds()),
+        ) * (
+            Value(1.0)
+            - Value(self.jitter) * Func(function="RANDOM", output_field=FloatField())
+        )
+        return ExpressionWrapper(
+            Value(now) + delay_seconds * Value(timedelta(seconds=1)),
+            output_field=DateTimeField(),
+        )
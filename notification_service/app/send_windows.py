@@ -0,0 +1,38 @@
+from datetime import datetime, time, timedelta
+
+import pytz
+
+from .models import TIMEZONES
+
+
+def get_send_window(
+    timezone: str, window_start: time, window_end: time, now: datetime
+) -> tuple[datetime, datetime]:
+    # The UTC bounds of the local time window open at `now`, or of the next
+    # one. A window ending before its start lasts past midnight.
+    tz = pytz.timezone(timezone)
+    today = now.astimezone(tz).date()
+    for day in (today - timedelta(days=1), today, today + timedelta(days=1)):
+        end_day = day + timedelta(days=1) if window_end <= window_start else day
+        eligible_until = tz.localize(datetime.combine(end_day, window_end))
+        if eligible_until > now:
+            eligible_from = tz.localize(datetime.combine(day, window_start))
+            return eligible_from.astimezone(pytz.utc), eligible_until.astimezone(
+                pytz.utc
+            )
+    raise AssertionError("The window of the next day always ends after now")
+
+
+def get_send_windows_sql(
+    window_start: time, window_end: time, now: datetime
+) -> tuple[str, list]:
+    # The windows are computed once per timezone and joined with the
+    # clients by the `send_window` alias, instead of converting every row
+    params = []
+    for timezone, _ in TIMEZONES:
+        params += [timezone, *get_send_window(timezone, window_start, window_end, now)]
+    values_sql = ", ".join(["(%s, %s::timestamptz, %s::timestamptz)"] * len(TIMEZONES))
+    return (
+        f"(VALUES {values_sql}) AS send_window (timezone, eligible_from, eligible_until)",
+        params,
+    )
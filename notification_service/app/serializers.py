@@ -16,6 +16,26 @@ class ClientSerializer(ModelSerializer):
         ]
 
 
+class ClientBulkUpdateSerializer(ModelSerializer):
+    class Meta:
+        model = Client
+        fields = [
+            "mobile_operator_code",
+            "tag",
+            "timezone",
+        ]
+        extra_kwargs = {
+            "mobile_operator_code": {"required": False},
+            "tag": {"required": False},
+            "timezone": {"required": False},
+        }
+
+    def validate(self, attrs: dict) -> dict:
+        if not attrs:
+            raise serializers.ValidationError("At least one field is required")
+        return attrs
+
+
 class MailingSerializer(ModelSerializer):
     class Meta:
         model = Mailing
@@ -27,9 +47,26 @@ class MailingSerializer(ModelSerializer):
             "content",
             "mobile_operator_code",
             "tag",
+            "send_window_start",
+            "send_window_end",
         ]
         read_only_fields = ["started_at"]
 
+    def validate(self, attrs: dict) -> dict:
+        send_window_start = attrs.get(
+            "send_window_start", getattr(self.instance, "send_window_start", None)
+        )
+        send_window_end = attrs.get(
+            "send_window_end", getattr(self.instance, "send_window_end", None)
+        )
+        if (send_window_start is None) != (send_window_end is None):
+            raise serializers.ValidationError(
+                "Both send window bounds are required to set a window"
+            )
+        if send_window_start is not None and send_window_start == send_window_end:
+            raise serializers.ValidationError("The send window is empty")
+        return attrs
+
 
 class MessageSerializer(ModelSerializer):
     class Meta:
@@ -39,6 +76,8 @@ class MessageSerializer(ModelSerializer):
             "created_at",
             "sent_at",
             "status",
+            "attempts",
+            "next_attempt_at",
             "mailing",
             "client",
         ]
@@ -50,6 +89,7 @@ class MessagesStatusesSerializer(serializers.Serializer):
     Succeed = serializers.IntegerField()
     Failed = serializers.IntegerField()
     Canceled = serializers.IntegerField()
+    Undelivered = serializers.IntegerField()
 
 
 class MailingStatsSerializer(serializers.Serializer):
@@ -59,3 +99,24 @@ class MailingStatsSerializer(serializers.Serializer):
 class MailingsStatsSerializer(serializers.Serializer):
     count = serializers.IntegerField()
     message_statuses = MessagesStatusesSerializer()
+
+
+class ClientImportErrorSerializer(serializers.Serializer):
+    row = serializers.IntegerField()
+    field_errors = serializers.DictField(child=serializers.ListField())
+
+
+class ClientImportResultSerializer(serializers.Serializer):
+    created = serializers.IntegerField()
+    updated = serializers.IntegerField()
+    errors_count = serializers.IntegerField()
+    row_errors = ClientImportErrorSerializer(many=True)
+    format_error = serializers.CharField(allow_null=True)
+
+
+class ClientBulkMutationResultSerializer(serializers.Serializer):
+    matched = serializers.IntegerField()
+    updated = serializers.IntegerField()
+    deleted = serializers.IntegerField()
+    blocked = serializers.IntegerField()
+    blocked_ids = serializers.ListField(child=serializers.IntegerField())
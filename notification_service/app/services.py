@@ -1,12 +1,14 @@
-import asyncio
-from collections.abc import Iterable
-from datetime import datetime
+import time
+from collections.abc import AsyncIterator, Iterable
+from datetime import datetime, timedelta
+from functools import partial
 from typing import Protocol
 
-from django.db import transaction
-from django.db.models import F, Q, QuerySet
-from more_itertools import batched
+from asgiref.sync import async_to_sync, sync_to_async
+from django.db import connection, transaction
+from django.db.models import Case, F, Q, QuerySet, Value, When
 
+from notification_service.utils.batch_size_tuner import AdaptiveBatchSize
 from notification_service.utils.mailing_client import (
     MailingClient,
     MailingMessage,
@@ -14,7 +16,10 @@ from notification_service.utils.mailing_client import (
 )
 from notification_service.utils.services import BaseService
 
-from .models import Client, Mailing, Message
+from .models import Client, Mailing, MailingStatusCounter, Message
+from .pipeline import MessageSendingPipeline
+from .retries import RetryPolicy
+from .send_windows import get_send_windows_sql
 
 
 class GetCurrentDateTimeCallable(Protocol):
@@ -27,6 +32,16 @@ class MailingStarterCallable(Protocol):
         ...
 
 
+class MailingStartSchedulerCallable(Protocol):
+    def __call__(self, mailing_id: int, start_at: datetime):
+        ...
+
+
+class MessagesSenderCallable(Protocol):
+    def __call__(self):
+        ...
+
+
 class UpcomingMailingsStarterService(BaseService):
     def __init__(
         self,
@@ -42,27 +57,87 @@ class UpcomingMailingsStarterService(BaseService):
 
     def _get_upcoming_mailings(self) -> list[int]:
         now = self.get_current_datetime()
-        return Mailing.objects.filter(
-            Q(finish_at__gt=now) | Q(finish_at=None),
-            start_at__lte=now,
-        ).values_list("id", flat=True)
+        return (
+            Mailing.objects.filter(
+                Q(finish_at__gt=now) | Q(finish_at=None),
+                start_at__lte=now,
+                started_at=None,
+            )
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+
+
+class MailingStartSchedulerService(BaseService):
+    # Schedules the start of the mailings at their start_at. Only the
+    # mailings starting within the horizon are scheduled, the brokers are
+    # not meant to hold far future tasks; the others are scheduled by the
+    # later runs. A mailing is scheduled once per start_at value.
+
+    def __init__(
+        self,
+        mailing_start_scheduler: MailingStartSchedulerCallable,
+        get_current_datetime: GetCurrentDateTimeCallable,
+        horizon: timedelta = timedelta(hours=1),
+    ):
+        self.mailing_start_scheduler = mailing_start_scheduler
+        self.get_current_datetime = get_current_datetime
+        self.horizon = horizon
+
+    @transaction.atomic()
+    def execute(self, mailing_ids: list[int] | None = None):
+        now = self.get_current_datetime()
+        mailings_qs = (
+            Mailing.objects.filter(
+                Q(finish_at__gt=now) | Q(finish_at=None),
+                start_at__lte=now + self.horizon,
+                started_at=None,
+            )
+            .exclude(scheduled_start_at=F("start_at"))
+            .select_for_update(skip_locked=True)
+        )
+        if mailing_ids is not None:
+            mailings_qs = mailings_qs.filter(id__in=mailing_ids)
+        mailings = list(mailings_qs.order_by("id").values_list("id", "start_at"))
+        if not mailings:
+            return
+
+        Mailing.objects.filter(
+            id__in=[mailing_id for mailing_id, _ in mailings]
+        ).update(scheduled_start_at=F("start_at"))
+        for mailing_id, start_at in mailings:
+            transaction.on_commit(
+                partial(self.mailing_start_scheduler, mailing_id, start_at)
+            )
 
 
 class MailingStarterService(BaseService):
-    def __init__(self, get_current_datetime: GetCurrentDateTimeCallable):
+    def __init__(
+        self,
+        get_current_datetime: GetCurrentDateTimeCallable,
+        chunk_size: int | None = None,
+        messages_sender: MessagesSenderCallable | None = None,
+    ):
         self.get_current_datetime = get_current_datetime
+        self.chunk_size = chunk_size or None
+        self.messages_sender = messages_sender
 
     @staticmethod
-    def _get_pending_mailing(mailing_id: int) -> Mailing | None:
-        return (
-            Mailing.objects.filter(id=mailing_id, started_at=None)
-            .select_for_update()
-            .first()
-        )
+    def _get_pending_mailing(
+        mailing_id: int, start_at: datetime | None = None
+    ) -> Mailing | None:
+        # A start scheduled for a since changed start_at is ignored
+        mailings_qs = Mailing.objects.filter(id=mailing_id, started_at=None)
+        if start_at is not None:
+            mailings_qs = mailings_qs.filter(start_at=start_at)
+        return mailings_qs.select_for_update().first()
 
     @staticmethod
     def _get_target_clients(mailing: Mailing) -> QuerySet:
-        target_clients_qs = Client.objects.values_list("id", flat=True)
+        # The timezone is only needed to place the messages in a send window
+        target_clients_qs = Client.objects.values_list(
+            *(("id", "timezone") if mailing.has_send_window else ("id",))
+        )
         if mailing.mobile_operator_code:
             target_clients_qs = target_clients_qs.filter(
                 mobile_operator_code=mailing.mobile_operator_code
@@ -71,25 +146,94 @@ class MailingStarterService(BaseService):
             target_clients_qs = target_clients_qs.filter(tag=mailing.tag)
         return target_clients_qs
 
+    def _get_target_clients_chunk(self, mailing: Mailing) -> QuerySet:
+        target_clients_qs = self._get_target_clients(mailing=mailing)
+        if self.chunk_size is None:
+            return target_clients_qs
+
+        if mailing.fanout_cursor is not None:
+            target_clients_qs = target_clients_qs.filter(id__gt=mailing.fanout_cursor)
+        return target_clients_qs.order_by("id")[: self.chunk_size]
+
     @staticmethod
-    def _create_mailing_message(client_id: int, mailing_id: int):
-        Message.objects.create(
-            client_id=client_id,
-            mailing_id=mailing_id,
-            status=Message.Status.PENDING,
-        )
+    def _create_mailing_messages(
+        mailing: Mailing, target_clients_qs: QuerySet, created_at: datetime
+    ) -> tuple[int, int | None]:
+        # A single INSERT ... SELECT keeps the fan-out cost independent
+        # of the audience size: no client ids travel through python.
+        clients_sql, clients_params = target_clients_qs.query.sql_with_params()
+        eligible_sql, send_window_sql = "NULL, NULL", ""
+        send_window_params: list = []
+        if send_window := mailing.send_window:
+            window_start, window_end = send_window
+            windows_sql, send_window_params = get_send_windows_sql(
+                window_start, window_end, created_at
+            )
+            eligible_sql = "send_window.eligible_from, send_window.eligible_until"
+            # Clients of an unknown timezone are not left out, they get no
+            # window, so the chunks are not cut short either
+            send_window_sql = (
+                f"LEFT JOIN {windows_sql} "
+                "ON send_window.timezone = target_client.timezone"
+            )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "WITH created_message AS ("
+                f"INSERT INTO {Message._meta.db_table} "
+                "(created_at, status, attempts, mailing_id, client_id, "
+                "eligible_from, eligible_until) "
+                f"SELECT %s, %s, 0, %s, target_client.id, {eligible_sql} "
+                f"FROM ({clients_sql}) AS target_client {send_window_sql} "
+                "RETURNING client_id"
+                ") SELECT COUNT(*), MAX(client_id) FROM created_message",
+                (
+                    created_at,
+                    Message.Status.PENDING,
+                    mailing.id,
+                    *clients_params,
+                    *send_window_params,
+                ),
+            )
+            return cursor.fetchone()
 
     @transaction.atomic()
-    def execute(self, mailing_id: int):
-        mailing = self._get_pending_mailing(mailing_id=mailing_id)
+    def _start_mailing_chunk(
+        self, mailing_id: int, start_at: datetime | None = None
+    ) -> bool | None:
+        # Whether more chunks are left, None if there is nothing to start
+        mailing = self._get_pending_mailing(mailing_id=mailing_id, start_at=start_at)
         if not mailing:
-            return
+            return None
 
-        for client_id in self._get_target_clients(mailing=mailing):
-            self._create_mailing_message(client_id=client_id, mailing_id=mailing_id)
+        created_count, last_client_id = self._create_mailing_messages(
+            mailing=mailing,
+            target_clients_qs=self._get_target_clients_chunk(mailing=mailing),
+            created_at=self.get_current_datetime(),
+        )
+        MailingStatusCounter.objects.add(
+            {(mailing.id, Message.Status.PENDING): created_count}
+        )
+
+        if self.chunk_size is not None and created_count == self.chunk_size:
+            mailing.fanout_cursor = last_client_id
+            mailing.save(update_fields=["fanout_cursor"])
+            return True
 
         mailing.started_at = self.get_current_datetime()
         mailing.save()
+        return False
+
+    def execute(self, mailing_id: int, start_at: datetime | None = None):
+        # Every chunk is committed on its own, so the messages become
+        # visible to the sender right away, and a killed task resumes
+        # from the persisted cursor on the next start attempt.
+        while more_chunks := self._start_mailing_chunk(
+            mailing_id=mailing_id, start_at=start_at
+        ):
+            pass
+        # The messages are sent right away instead of on the next sweep
+        if more_chunks is not None and self.messages_sender:
+            self.messages_sender()
 
 
 class UpcomingMessagesSenderService(BaseService):
@@ -97,79 +241,293 @@ class UpcomingMessagesSenderService(BaseService):
         self,
         mailing_client: MailingClient,
         get_current_datetime: GetCurrentDateTimeCallable,
+        claim_lease: timedelta = timedelta(minutes=5),
+        batch_size: int = 200,
+        pipelined: bool = False,
+        concurrency: int = 10,
+        flush_size: int = 200,
+        flush_interval: float = 1.0,
+        retry_policy: RetryPolicy | None = None,
+        batch_deadline: float | None = None,
+        partition: int = 0,
+        partitions: int = 1,
+        batch_size_tuner: AdaptiveBatchSize | None = None,
+        flush_size_tuner: AdaptiveBatchSize | None = None,
+        run_time_budget: float | None = None,
     ):
         self.mailing_client = mailing_client
         self.get_current_datetime = get_current_datetime
+        self.claim_lease = claim_lease
+        self.batch_size = batch_size
+        self.pipelined = pipelined
+        self.concurrency = concurrency
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.batch_deadline = batch_deadline
+        # The messages are split into `partitions` slices by id, the service
+        # handles one of them. Senders of different slices never compete
+        # for the same rows.
+        self.partition = partition
+        self.partitions = partitions
+        # When given, the tuners size the claimed batches and the write-backs
+        # by their DB latency instead of `batch_size` and `flush_size`
+        self.batch_size_tuner = batch_size_tuner
+        self.flush_size_tuner = flush_size_tuner
+        # No batches are claimed after `run_time_budget` seconds of the run,
+        # the claimed ones are still sent and written back
+        self.run_time_budget = run_time_budget
+        self._mailing_contents: dict[int, str] = {}
+        self._run_deadline: float | None = None
+        self._out_of_time = False
 
-    @staticmethod
-    def _cancel_overdue_messages(now: datetime):
-        Message.objects.filter(
+    def _get_partition_messages(self) -> QuerySet[Message]:
+        if self.partitions == 1:
+            return Message.objects.all()
+        return Message.objects.alias(partition=F("id") % self.partitions).filter(
+            partition=self.partition
+        )
+
+    def _cancel_overdue_messages(self, now: datetime):
+        self._get_partition_messages().filter(
             mailing__finish_at__lt=now, status=Message.Status.PENDING
         ).update(status=Message.Status.CANCELED)
 
-    @staticmethod
-    def _get_message_batches(batch_size: int) -> Iterable[Iterable[Message]]:
-        messages_qs = Message.objects.filter(
-            status__in=[
-                Message.Status.PENDING,
-                Message.Status.FAILED,
-            ],
+    def _move_missed_send_windows(self, now: datetime):
+        # Messages not sent within the window of their client's day wait for
+        # the window of the next one
+        missed_qs = self._get_partition_messages().filter(
+            eligible_until__lte=now,
+            status__in=[Message.Status.PENDING, Message.Status.FAILED],
         )
+        # The window may be removed after the start, the messages of such
+        # mailings are not held back anymore
+        missed_qs.filter(
+            Q(mailing__send_window_start=None) | Q(mailing__send_window_end=None)
+        ).update(eligible_from=None, eligible_until=None)
+        for mailing in Mailing.objects.filter(
+            id__in=missed_qs.values("mailing_id")
+        ).order_by("id"):
+            if not (send_window := mailing.send_window):
+                continue
+            window_start, window_end = send_window
+            send_window_sql, send_window_params = get_send_windows_sql(
+                window_start, window_end, now
+            )
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE {Message._meta.db_table} AS message SET "
+                    "eligible_from = send_window.eligible_from, "
+                    "eligible_until = send_window.eligible_until "
+                    f"FROM {Client._meta.db_table} AS client, {send_window_sql} "
+                    "WHERE message.mailing_id = %s "
+                    "AND message.status IN (%s, %s) "
+                    "AND message.eligible_until <= %s "
+                    "AND message.id %% %s = %s "
+                    "AND client.id = message.client_id "
+                    "AND send_window.timezone = client.timezone",
+                    (
+                        *send_window_params,
+                        mailing.id,
+                        Message.Status.PENDING,
+                        Message.Status.FAILED,
+                        now,
+                        self.partitions,
+                        self.partition,
+                    ),
+                )
 
-        if not messages_qs.count():
-            return []
-
-        return batched(
-            messages_qs.annotate(
+    @transaction.atomic()
+    def _claim_message_batch(
+        self, batch_size: int, last_message_id: int, status: Message.Status
+    ) -> list[Message]:
+        # Rows locked by a concurrent sender are skipped, and the claimed
+        # ones get a lease, so the other senders leave them alone until
+        # they are written back or the lease expires after a crash.
+        now = self.get_current_datetime()
+        messages = list(
+            self._get_partition_messages()
+            .filter(
+                Q(claimed_until=None) | Q(claimed_until__lt=now),
+                Q(next_attempt_at=None) | Q(next_attempt_at__lte=now),
+                Q(eligible_from=None)
+                | Q(eligible_from__lte=now, eligible_until__gt=now),
+                status=status,
+                id__gt=last_message_id,
+            )
+            .only("id", "mailing_id")
+            .annotate(
                 client_phone_number=F("client__phone_number"),
-                mailing_content=F("mailing__content"),
-            ).iterator(chunk_size=batch_size),
-            batch_size,
+                client_mobile_operator_code=F("client__mobile_operator_code"),
+            )
+            .select_for_update(skip_locked=True, of=("self",))
+            .order_by("id")[:batch_size]
         )
+        if messages:
+            Message.objects.filter(id__in=[message.id for message in messages]).update(
+                claimed_until=now + self.claim_lease
+            )
+            self._load_mailing_contents({message.mailing_id for message in messages})
+        return messages
 
-    def _get_mailing_message_batches(
-        self, batch_size: int
-    ) -> Iterable[Iterable[MailingMessage]]:
-        for message_batch in self._get_message_batches(batch_size):
-            mailing_messages = [
-                MailingMessage(
-                    msg_id=message.id,
-                    phone=message.client_phone_number,  # noqa - annotated
-                    text=message.mailing_content,  # noqa - annotated
-                )
-                for message in message_batch
-            ]
-            yield mailing_messages
-        else:
-            yield from ()
+    def _load_mailing_contents(self, mailing_ids: set[int]):
+        # The content is read once per mailing and run instead of with
+        # every message, and all the messages of a mailing share it
+        if missing_ids := mailing_ids - self._mailing_contents.keys():
+            self._mailing_contents.update(
+                Mailing.objects.filter(id__in=missing_ids).values_list("id", "content")
+            )
+
+    def _get_batch_size(self) -> int:
+        if self.batch_size_tuner:
+            return self.batch_size_tuner.size
+        return self.batch_size
+
+    def _get_flush_size(self) -> int:
+        if self.flush_size_tuner:
+            return self.flush_size_tuner.size
+        return self.flush_size
 
-    def _send_messages(self, messages: Iterable[MailingMessage]):
-        asyncio.run(
-            self.mailing_client.post_message_batch(messages),
+    async def _claim_tuned_message_batch(
+        self, last_message_id: int, status: Message.Status
+    ) -> list[Message]:
+        started_at = time.monotonic()
+        messages = await sync_to_async(self._claim_message_batch)(
+            self._get_batch_size(), last_message_id, status
         )
+        if self.batch_size_tuner:
+            self.batch_size_tuner.observe(len(messages), time.monotonic() - started_at)
+        return messages
 
-    @staticmethod
-    def _update_sent_messages(
-        mailing_messages: Iterable[MailingMessage], now: datetime
-    ):
-        update_messages = []
+    async def _get_mailing_message_batches(self) -> AsyncIterator[list[MailingMessage]]:
+        # Fresh messages go first, so retries can not starve them. Walking
+        # the ids forward makes every message visited at most once per run.
+        for status in (Message.Status.PENDING, Message.Status.FAILED):
+            last_message_id = 0
+            while messages := await self._claim_tuned_message_batch(
+                last_message_id, status
+            ):
+                yield [
+                    MailingMessage(
+                        msg_id=message.id,
+                        phone=message.client_phone_number,  # noqa - annotated
+                        text=self._mailing_contents[message.mailing_id],
+                        operator_code=message.client_mobile_operator_code,  # noqa
+                    )
+                    for message in messages
+                ]
+                last_message_id = messages[-1].id
+                if (
+                    self._run_deadline is not None
+                    and time.monotonic() >= self._run_deadline
+                ):
+                    self._out_of_time = True
+                    return
+
+    @transaction.atomic()
+    def _update_sent_messages(self, mailing_messages: Iterable[MailingMessage]):
+        # The time of the write-back, not of the run start, so the retries
+        # of a long run are not due before they are written
+        now = self.get_current_datetime()
+        succeed_ids, failed_ids, unsent_ids = [], [], []
         for mailing_message in mailing_messages:
-            update_messages.append(
-                Message(
-                    id=mailing_message.msg_id,
-                    status=Message.Status.SUCCEED
-                    if mailing_message.status == MailingMessageStatus.SUCCEED
-                    else Message.Status.FAILED,
-                    sent_at=now,
-                )
+            if mailing_message.status == MailingMessageStatus.SUCCEED:
+                succeed_ids.append(mailing_message.msg_id)
+            elif mailing_message.status == MailingMessageStatus.PENDING:
+                unsent_ids.append(mailing_message.msg_id)
+            else:
+                failed_ids.append(mailing_message.msg_id)
+
+        if succeed_ids:
+            Message.objects.filter(id__in=succeed_ids).update(
+                status=Message.Status.SUCCEED,
+                sent_at=now,
+                claimed_until=None,
+                attempts=F("attempts") + 1,
+            )
+        if failed_ids:
+            # The assignments see the attempts made before this one
+            Message.objects.filter(id__in=failed_ids).update(
+                status=Case(
+                    When(
+                        attempts__gte=self.retry_policy.max_attempts - 1,
+                        then=Value(Message.Status.UNDELIVERED),
+                    ),
+                    default=Value(Message.Status.FAILED),
+                ),
+                next_attempt_at=self.retry_policy.next_attempt_at_expression(
+                    now, attempts_field="attempts"
+                ),
+                sent_at=now,
+                claimed_until=None,
+                attempts=F("attempts") + 1,
             )
-        if update_messages:
-            Message.objects.bulk_update(update_messages, ["status", "sent_at"])
+        if unsent_ids:
+            # Posts cancelled by the deadline are not counted as attempts,
+            # the messages are just released for the next run
+            Message.objects.filter(id__in=unsent_ids).update(claimed_until=None)
 
-    def execute(self):
+    async def _write_back(self, mailing_messages: list[MailingMessage]):
+        # In flushes of `flush_size`, as the pipelined sender writes back
+        position = 0
+        while position < len(mailing_messages):
+            flush_end = position + self._get_flush_size()
+            flush = mailing_messages[position:flush_end]
+            started_at = time.monotonic()
+            await sync_to_async(self._update_sent_messages)(mailing_messages=flush)
+            if self.flush_size_tuner:
+                self.flush_size_tuner.observe(len(flush), time.monotonic() - started_at)
+            position = flush_end
+
+    async def _send_upcoming_messages(self):
+        # One event loop and one pooled http session serve the whole run.
+        # The DB calls run in the calling thread, keeping its connection.
+        async with self.mailing_client.session():
+            async for mailing_messages in self._get_mailing_message_batches():
+                try:
+                    await self.mailing_client.post_message_batch(
+                        mailing_messages,
+                        deadline=self.batch_deadline,
+                        concurrency=self.concurrency,
+                    )
+                finally:
+                    await self._write_back(mailing_messages)
+
+    async def _send_upcoming_messages_pipelined(self):
+        # Claiming, posting and writing back overlap instead of taking
+        # turns, so the mailing api is kept busy during the DB round trips.
+        pipeline = MessageSendingPipeline(
+            read_batches=self._get_mailing_message_batches,
+            post_message=self.mailing_client.post_message,
+            write_results=lambda mailing_messages: sync_to_async(
+                self._update_sent_messages
+            )(mailing_messages=mailing_messages),
+            # Enough posters for the adaptive window to grow into
+            concurrency=self.mailing_client.max_concurrency or self.concurrency,
+            queue_size=self.batch_size * 2,
+            flush_size=self.flush_size,
+            flush_interval=self.flush_interval,
+            post_deadline=self.batch_deadline,
+            flush_size_tuner=self.flush_size_tuner,
+            # The queued messages get the time a claimed batch has to be
+            # posted after the last claim
+            post_until=None
+            if self._run_deadline is None
+            else self._run_deadline + (self.batch_deadline or 0),
+        )
+        async with self.mailing_client.session():
+            await pipeline.run()
+
+    def execute(self) -> bool:
+        # Whether the run was stopped by its time budget before the queue
+        # was drained
+        if self.run_time_budget is not None:
+            self._run_deadline = time.monotonic() + self.run_time_budget
         now = self.get_current_datetime()
         self._cancel_overdue_messages(now)
-
-        for mailing_messages in self._get_mailing_message_batches(200):
-            self._send_messages(mailing_messages)
-            self._update_sent_messages(mailing_messages=mailing_messages, now=now)
+        self._move_missed_send_windows(now)
+        if self.pipelined:
+            async_to_sync(self._send_upcoming_messages_pipelined)()
+        else:
+            async_to_sync(self._send_upcoming_messages)()
+        return self._out_of_time
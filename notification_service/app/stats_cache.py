@@ -0,0 +1,71 @@
+import hashlib
+import time
+import uuid
+from collections.abc import Callable, Iterable
+
+from django.conf import settings
+from django.core.cache import cache
+
+MAILINGS_STATS_GENERATION_KEY = "mailings-stats-generation"
+
+
+def _get_mailing_stats_generation_key(mailing_id: int) -> str:
+    return f"mailing-stats-generation:{mailing_id}"
+
+
+def invalidate_mailing_stats(mailing_ids: Iterable[int]):
+    # The cached stats are keyed by a generation, so a value recomputed
+    # concurrently with the invalidation is stored under a stale key and
+    # never served.
+    generation = uuid.uuid4().hex
+    cache.set_many(
+        {
+            MAILINGS_STATS_GENERATION_KEY: generation,
+            **{
+                _get_mailing_stats_generation_key(mailing_id): generation
+                for mailing_id in mailing_ids
+            },
+        },
+        timeout=None,
+    )
+
+
+def _get_or_compute(key: str, compute: Callable[[], dict]) -> dict:
+    if (value := cache.get(key)) is not None:
+        return value
+
+    # Single flight: the request that takes the lock recomputes the value,
+    # the concurrent ones wait for it. The lock expires if its holder dies.
+    lock_key = f"{key}:lock"
+    while not cache.add(
+        lock_key, True, timeout=settings.MAILING_STATS_CACHE_LOCK_TIMEOUT
+    ):
+        time.sleep(0.05)
+        if (value := cache.get(key)) is not None:
+            return value
+    try:
+        value = compute()
+        cache.set(key, value, timeout=settings.MAILING_STATS_CACHE_TTL)
+    finally:
+        cache.delete(lock_key)
+    return value
+
+
+def get_mailing_stats(mailing_id: int, compute: Callable[[], dict]) -> dict:
+    if not settings.MAILING_STATS_CACHE_TTL:
+        return compute()
+    generation = cache.get(_get_mailing_stats_generation_key(mailing_id), "")
+    return _get_or_compute(f"mailing-stats:{mailing_id}:{generation}", compute)
+
+
+def get_mailings_stats(
+    query_params: dict[str, list[str]], compute: Callable[[], dict]
+) -> dict:
+    if not settings.MAILING_STATS_CACHE_TTL:
+        return compute()
+    generation = cache.get(MAILINGS_STATS_GENERATION_KEY, "")
+    # Every filtered variant of the stats is cached on its own
+    query_digest = hashlib.md5(
+        repr(sorted(query_params.items())).encode(), usedforsecurity=False
+    ).hexdigest()
+    return _get_or_compute(f"mailings-stats:{generation}:{query_digest}", compute)
@@ -1,18 +1,79 @@
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from functools import cache, wraps
+
+import httpx
+from aiolimiter import AsyncLimiter
+from asgiref.sync import async_to_sync, sync_to_async
+from celery import group
 from django.conf import settings
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from redis import Redis as SyncRedis
+from redis.asyncio import Redis
 
 from config import celery_app
+from notification_service.utils.batch_size_tuner import AdaptiveBatchSize
+from notification_service.utils.concurrency_limiter import AdaptiveConcurrencyLimiter
 from notification_service.utils.mailing_client import MailingClient
+from notification_service.utils.rate_limiter import RateLimiter, RedisTokenBucketLimiter
+from notification_service.utils.task_lock import RedisLease
 
+from .retries import RetryPolicy
 from .services import (
     MailingStarterService,
+    MailingStartSchedulerService,
     UpcomingMailingsStarterService,
     UpcomingMessagesSenderService,
 )
 
 
+@cache
+def _get_task_lock_redis(url: str) -> SyncRedis:
+    # Shared by the task runs of the worker process, with its connection pool
+    return SyncRedis.from_url(url)
+
+
+def _single_flight(get_max_runs: Callable[[], int] = lambda: 1):
+    # Overlapping runs of a periodic task with the same arguments are
+    # skipped, at most `get_max_runs()` of them run at a time
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not settings.MAILING_TASK_LOCK_REDIS_URL:
+                return func(*args, **kwargs)
+            lease = RedisLease(
+                redis=_get_task_lock_redis(settings.MAILING_TASK_LOCK_REDIS_URL),
+                name=":".join(["task-lease", func.__name__, *map(str, args)]),
+                ttl=settings.MAILING_TASK_LEASE_TTL,
+                slots=get_max_runs(),
+            )
+            return lease.run_exclusively(func, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def schedule_mailing_starts(mailing_ids: list[int] | None = None):
+    mailing_start_scheduler = MailingStartSchedulerService(
+        mailing_start_scheduler=lambda mailing_id, start_at: start_mailing.apply_async(
+            (mailing_id, start_at.isoformat()), eta=start_at
+        ),
+        get_current_datetime=timezone.now,
+        horizon=timedelta(seconds=settings.MAILING_START_SCHEDULE_HORIZON),
+    )
+    mailing_start_scheduler.execute(mailing_ids)
+
+
 @celery_app.task()
+@_single_flight()
 def start_upcoming_mailings():
+    # The mailings are started by the tasks scheduled at their start_at,
+    # this sweep schedules the ones entering the horizon and starts the due
+    # ones whose start task got lost
+    schedule_mailing_starts()
     upcoming_mailings_starter = UpcomingMailingsStarterService(
         mailing_starter=start_mailing.delay,
         get_current_datetime=timezone.now,
@@ -21,15 +82,143 @@ def start_upcoming_mailings():
 
 
 @celery_app.task()
-def start_mailing(mailing_id: int):
-    mailing_starter = MailingStarterService(get_current_datetime=timezone.now)
-    mailing_starter.execute(mailing_id)
+def start_mailing(mailing_id: int, start_at: str | None = None):
+    mailing_starter = MailingStarterService(
+        get_current_datetime=timezone.now,
+        chunk_size=settings.MAILING_FANOUT_CHUNK_SIZE,
+        messages_sender=send_upcoming_messages.delay,
+    )
+    mailing_starter.execute(
+        mailing_id, start_at=parse_datetime(start_at) if start_at else None
+    )
+
+
+@asynccontextmanager
+async def _open_rate_limiter() -> AsyncIterator[RateLimiter]:
+    if not settings.MAILING_RATE_LIMITER_REDIS_URL:
+        yield AsyncLimiter(
+            max_rate=settings.MAILING_RATE_LIMIT,
+            time_period=settings.MAILING_RATE_LIMIT_PERIOD,
+        )
+        return
+    # Shared by all the worker processes
+    rate_limiter = RedisTokenBucketLimiter(
+        redis=Redis.from_url(settings.MAILING_RATE_LIMITER_REDIS_URL),
+        name="mailing_rate_limit",
+        max_rate=settings.MAILING_RATE_LIMIT,
+        time_period=settings.MAILING_RATE_LIMIT_PERIOD,
+    )
+    try:
+        yield rate_limiter
+    finally:
+        await rate_limiter.aclose()
+
+
+@cache
+def _get_concurrency_limiter(
+    initial_window: int, max_window: int
+) -> AdaptiveConcurrencyLimiter:
+    # Shared by the sender runs of the worker process, so the learnt window
+    # and the Retry-After pause are not reset by every run
+    return AdaptiveConcurrencyLimiter(
+        initial_window=initial_window, max_window=max_window
+    )
+
+
+def _create_mailing_client(rate_limiter: RateLimiter) -> MailingClient:
+    return MailingClient(
+        token=settings.MAILING_SERVICE_TOKEN,
+        rate_limiter=rate_limiter,
+        limits=httpx.Limits(
+            max_connections=settings.MAILING_CLIENT_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.MAILING_CLIENT_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.MAILING_CLIENT_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            settings.MAILING_CLIENT_READ_TIMEOUT,
+            connect=settings.MAILING_CLIENT_CONNECT_TIMEOUT,
+            pool=settings.MAILING_CLIENT_POOL_TIMEOUT,
+        ),
+        http2=settings.MAILING_CLIENT_HTTP2,
+        rate_limit_by_operator=bool(
+            settings.MAILING_RATE_LIMITER_REDIS_URL
+            and settings.MAILING_RATE_LIMIT_BY_OPERATOR
+        ),
+        concurrency_limiter=_get_concurrency_limiter(
+            settings.MAILING_CLIENT_INITIAL_CONCURRENCY,
+            settings.MAILING_CLIENT_MAX_CONCURRENCY,
+        )
+        if settings.MAILING_CLIENT_ADAPTIVE_CONCURRENCY
+        else None,
+    )
+
+
+def _create_batch_size_tuner(name: str, initial_size: int) -> AdaptiveBatchSize | None:
+    if not settings.MAILING_SENDER_AUTOTUNE:
+        return None
+    return AdaptiveBatchSize(
+        name,
+        initial_size=initial_size,
+        max_size=settings.MAILING_SENDER_AUTOTUNE_MAX_SIZE,
+        target_latency=settings.MAILING_SENDER_AUTOTUNE_TARGET_LATENCY,
+    )
 
 
 @celery_app.task()
 def send_upcoming_messages():
-    mailing_client = MailingClient(token=settings.MAILING_SERVICE_TOKEN)
-    upcoming_messages_sender = UpcomingMessagesSenderService(
-        mailing_client=mailing_client, get_current_datetime=timezone.now
-    )
-    upcoming_messages_sender.execute()
+    # Every partition of the messages is drained by a task of its own, so
+    # the sending is spread over the workers
+    partitions = settings.MAILING_SENDER_PARTITIONS
+    if partitions == 1:
+        send_upcoming_messages_partition(0, 1)
+        return
+    group(
+        send_upcoming_messages_partition.s(partition, partitions)
+        for partition in range(partitions)
+    ).apply_async()
+
+
+@celery_app.task()
+def send_upcoming_messages_partition(partition: int, partitions: int):
+    # A run stopped by its time budget is continued by a new task once its
+    # lease is released, so the soft time limit never cuts a run short
+    if _send_upcoming_messages_partition(partition, partitions):
+        send_upcoming_messages_partition.delay(partition, partitions)
+
+
+@_single_flight(lambda: settings.MAILING_SENDER_MAX_RUNS)
+def _send_upcoming_messages_partition(partition: int, partitions: int) -> bool:
+    # The run is hosted by an event loop of its own: the service's async
+    # calls run in it, and the redis connections of the rate limiter, bound
+    # to it, are closed in it once the run is over
+    async def run() -> bool:
+        async with _open_rate_limiter() as rate_limiter:
+            upcoming_messages_sender = UpcomingMessagesSenderService(
+                mailing_client=_create_mailing_client(rate_limiter),
+                get_current_datetime=timezone.now,
+                claim_lease=timedelta(seconds=settings.MAILING_SENDER_CLAIM_LEASE),
+                batch_size=settings.MAILING_SENDER_BATCH_SIZE,
+                pipelined=settings.MAILING_SENDER_PIPELINED,
+                concurrency=settings.MAILING_SENDER_CONCURRENCY,
+                flush_size=settings.MAILING_SENDER_FLUSH_SIZE,
+                flush_interval=settings.MAILING_SENDER_FLUSH_INTERVAL,
+                batch_deadline=settings.MAILING_SENDER_BATCH_DEADLINE,
+                retry_policy=RetryPolicy(
+                    max_attempts=settings.MAILING_RETRY_MAX_ATTEMPTS,
+                    base_delay=timedelta(seconds=settings.MAILING_RETRY_BASE_DELAY),
+                    max_delay=timedelta(seconds=settings.MAILING_RETRY_MAX_DELAY),
+                    jitter=settings.MAILING_RETRY_JITTER,
+                ),
+                partition=partition,
+                partitions=partitions,
+                batch_size_tuner=_create_batch_size_tuner(
+                    "claim batch", settings.MAILING_SENDER_BATCH_SIZE
+                ),
+                flush_size_tuner=_create_batch_size_tuner(
+                    "flush", settings.MAILING_SENDER_FLUSH_SIZE
+                ),
+                run_time_budget=settings.MAILING_SENDER_RUN_TIME_BUDGET,
+            )
+            return await sync_to_async(upcoming_messages_sender.execute)()
+
+    return async_to_sync(run)()
@@ -1,3 +1,6 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from notification_service.utils.mailing_client import (
     MailingMessage,
     MailingMessageStatus,
@@ -5,12 +8,56 @@ from notification_service.utils.mailing_client import (
 
 
 class TestMailingClient:
-    posted_messages = []
+    def __init__(
+        self,
+        post_delay: float = 0,
+        failing_phones: set[str] = frozenset(),
+        hanging_phones: set[str] = frozenset(),
+        max_concurrency: int | None = None,
+    ):
+        self.posted_messages = []
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.post_delay = post_delay
+        self.failing_phones = failing_phones
+        self.hanging_phones = hanging_phones
+
+    @asynccontextmanager
+    async def session(self):
+        yield
 
     async def post_message(self, message: MailingMessage):
-        message.status = MailingMessageStatus.SUCCEED
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await self._post_message(message)
+        finally:
+            self.in_flight -= 1
+
+    async def _post_message(self, message: MailingMessage):
+        if self.post_delay:
+            await asyncio.sleep(self.post_delay)
+        if message.phone in self.hanging_phones:
+            await asyncio.Event().wait()
+        message.status = (
+            MailingMessageStatus.FAILED
+            if message.phone in self.failing_phones
+            else MailingMessageStatus.SUCCEED
+        )
         self.posted_messages.append(message)
 
-    async def post_message_batch(self, messages: list[MailingMessage]):
-        for msg in messages:
-            await self.post_message(msg)
+    async def post_message_batch(
+        self,
+        messages: list[MailingMessage],
+        deadline: float | None = None,
+        concurrency: int | None = None,
+    ):
+        async def post_messages():
+            for msg in messages:
+                await self.post_message(msg)
+
+        try:
+            await asyncio.wait_for(post_messages(), deadline)
+        except asyncio.TimeoutError:
+            pass
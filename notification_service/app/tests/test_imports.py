@@ -0,0 +1,139 @@
+import io
+import json
+
+import pytest
+from django.db import connection
+from django.urls import reverse
+
+from notification_service.app.imports import (
+    ClientImporter,
+    ImportFormatError,
+    iter_json_array,
+)
+from notification_service.app.models import Client
+from notification_service.app.tests.factories import ClientFactory
+
+pytestmark = pytest.mark.django_db
+
+ROWS = [
+    {"phone_number": "79000000001", "mobile_operator_code": "900", "tag": "a"},
+    {
+        "phone_number": "79000000002",
+        "mobile_operator_code": "900",
+        "tag": "b",
+        "timezone": "Europe/Moscow",
+    },
+    {"phone_number": "89000000003", "mobile_operator_code": "900", "tag": "c"},
+    {
+        "phone_number": "79000000004",
+        "mobile_operator_code": "9000",
+        "tag": "d",
+        "timezone": "Mars/Olympus",
+    },
+]
+IMPORT_FIELDS = ["phone_number", "mobile_operator_code", "tag", "timezone"]
+
+
+def _get_clients() -> list[tuple]:
+    return list(
+        Client.objects.order_by("phone_number", "id").values_list(*IMPORT_FIELDS)
+    )
+
+
+def _to_csv(rows: list[dict]) -> str:
+    return "\n".join(
+        [",".join(IMPORT_FIELDS)]
+        + [",".join(row.get(field, "") for field in IMPORT_FIELDS) for row in rows]
+    )
+
+
+@pytest.mark.parametrize(
+    "content_type, body",
+    [
+        ("application/json", json.dumps(ROWS)),
+        ("application/x-ndjson", "\n".join(json.dumps(row) for row in ROWS)),
+        ("text/csv", _to_csv(ROWS)),
+    ],
+)
+def test_import_clients(client, content_type, body):
+    response = client.post(
+        reverse("api:client-import-clients"), body, content_type=content_type
+    )
+
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["created"], result["updated"], result["errors_count"]) == (2, 0, 2)
+    assert [
+        (error["row"], set(error["field_errors"])) for error in result["row_errors"]
+    ] == [
+        (3, {"phone_number"}),
+        (4, {"mobile_operator_code", "timezone"}),
+    ]
+    assert _get_clients() == [
+        ("79000000001", "900", "a", "UTC"),
+        ("79000000002", "900", "b", "Europe/Moscow"),
+    ]
+
+
+def test_import_clients_upsert(client):
+    ClientFactory(phone_number="79000000001", tag="old")
+    rows = ROWS[:2] + [{**ROWS[1], "tag": "last"}]
+
+    response = client.post(
+        reverse("api:client-import-clients") + "?upsert=true",
+        json.dumps(rows),
+        content_type="application/json",
+    )
+
+    assert (response.json()["created"], response.json()["updated"]) == (1, 1)
+    assert [values[:3] for values in _get_clients()] == [
+        ("79000000001", "900", "a"),
+        ("79000000002", "900", "last"),
+    ]
+
+
+def test_import_clients_keeps_rows_before_malformed_body(client):
+    response = client.post(
+        reverse("api:client-import-clients"),
+        json.dumps(ROWS)[:-10],
+        content_type="application/json",
+    )
+
+    assert response.status_code == 400
+    result = response.json()
+    assert (result["created"], result["errors_count"]) == (2, 1)
+    assert result["format_error"].startswith("Invalid JSON")
+    assert len(_get_clients()) == 2
+
+
+def test_import_clients_rejects_unknown_format(client):
+    response = client.post(
+        reverse("api:client-import-clients"), "", content_type="application/xml"
+    )
+
+    assert response.status_code == 415
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1024])
+def test_json_array_is_read_in_chunks(chunk_size):
+    items = [{"text": "привет, [мир]"}, {"n": 1}, [], "x"]
+    stream = io.BytesIO(json.dumps(items).encode())
+
+    assert list(iter_json_array(stream, chunk_size=chunk_size)) == items
+
+
+@pytest.mark.parametrize("body", ["", "{}", "[{}", "[{}, {]"])
+def test_json_array_errors(body):
+    with pytest.raises(ImportFormatError):
+        list(iter_json_array(io.BytesIO(body.encode())))
+
+
+@pytest.mark.parametrize("upsert", [False, True])
+def test_client_importer_without_copy(monkeypatch, upsert):
+    ClientFactory(phone_number="79000000001", tag="old")
+    monkeypatch.setattr(connection, "vendor", "sqlite")
+
+    result = ClientImporter(upsert=upsert, batch_size=1).execute(ROWS[:2])
+
+    assert (result.created, result.updated) == ((1, 1) if upsert else (2, 0))
+    assert len(_get_clients()) == (2 if upsert else 3)
@@ -1,8 +1,10 @@
 from collections import OrderedDict
 
 import pytest
+from django.core.management import call_command
+from django.db.models import Count
 
-from ..models import Mailing, Message
+from ..models import Mailing, MailingStatusCounter, Message
 from .factories import MailingFactory, MessageFactory
 
 pytestmark = pytest.mark.django_db
@@ -17,6 +19,7 @@ def test_mailing_stats():
             (Message.Status.SUCCEED, 5),
             (Message.Status.FAILED, 2),
             (Message.Status.CANCELED, 0),
+            (Message.Status.UNDELIVERED, 0),
         ]
     )
     for status, count in expected_stats.items():
@@ -24,3 +27,86 @@ def test_mailing_stats():
             MessageFactory(mailing=mailing, status=status)
 
     assert Mailing.objects.filter(pk=mailing.id).stats() == expected_stats
+
+
+def _count_statuses() -> dict[tuple[int, str], int]:
+    return {
+        (stat["mailing_id"], stat["status"]): stat["count"]
+        for stat in Message.objects.values("mailing_id", "status").annotate(
+            count=Count("id")
+        )
+    }
+
+
+def _get_counters() -> dict[tuple[int, str], int]:
+    return {
+        (counter.mailing_id, counter.status): counter.count
+        for counter in MailingStatusCounter.objects.exclude(count=0)
+    }
+
+
+def test_status_counters_follow_message_changes():
+    mailings = MailingFactory.create_batch(2)
+    messages = [
+        MessageFactory(mailing=mailing) for mailing in mailings for _ in range(5)
+    ]
+
+    Message.objects.filter(mailing=mailings[0], id__lte=messages[1].id).update(
+        status=Message.Status.SUCCEED
+    )
+    Message.objects.filter(mailing__in=mailings, status=Message.Status.PENDING).update(
+        status=Message.Status.FAILED
+    )
+    messages[9].refresh_from_db()
+    messages[9].status = Message.Status.CANCELED
+    messages[9].save()
+    for message in messages[5:7]:
+        message.status = Message.Status.UNDELIVERED
+    Message.objects.bulk_update(messages[5:7], ["status"])
+
+    assert _get_counters() == _count_statuses()
+
+
+def test_status_counters_follow_message_deletes():
+    mailings = MailingFactory.create_batch(2)
+    messages = [
+        MessageFactory(mailing=mailing) for mailing in mailings for _ in range(3)
+    ]
+    Message.objects.filter(id=messages[0].id).update(status=Message.Status.SUCCEED)
+
+    assert Message.objects.filter(
+        mailing__in=mailings, id__lte=messages[3].id
+    ).delete() == (4, {"app.Message": 4})
+    messages[5].delete()
+
+    assert _get_counters() == _count_statuses()
+    assert _get_counters() == {(mailings[1].id, Message.Status.PENDING): 1}
+
+
+def test_sliced_message_updates_are_rejected():
+    MessageFactory()
+
+    with pytest.raises(TypeError):
+        Message.objects.all()[:1].update(status=Message.Status.SUCCEED)
+
+
+def test_updates_without_status_keep_counters():
+    message = MessageFactory()
+
+    Message.objects.filter(id=message.id).update(attempts=1)
+
+    assert _get_counters() == {(message.mailing_id, Message.Status.PENDING): 1}
+
+
+def test_reconcile_mailing_counters_command():
+    mailings = MailingFactory.create_batch(2)
+    for mailing in mailings:
+        MessageFactory.create_batch(3, mailing=mailing)
+    MailingStatusCounter.objects.update(count=100)
+
+    call_command("reconcile_mailing_counters", mailings[0].id)
+    assert _get_counters()[(mailings[0].id, Message.Status.PENDING)] == 3
+    assert _get_counters()[(mailings[1].id, Message.Status.PENDING)] == 100
+
+    call_command("reconcile_mailing_counters")
+    assert _get_counters() == _count_statuses()
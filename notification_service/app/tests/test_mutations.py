@@ -0,0 +1,101 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+
+from notification_service.app.models import Client
+from notification_service.app.mutations import ClientBulkMutation
+from notification_service.app.tests.factories import ClientFactory, MessageFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def test_bulk_update_clients(client):
+    clients = ClientFactory.create_batch(3, tag="old", mobile_operator_code="900")
+    other_client = ClientFactory(tag="other", mobile_operator_code="900")
+
+    response = client.patch(
+        reverse("api:client-bulk") + "?tag=old",
+        {"tag": "new", "mobile_operator_code": "901"},
+        content_type="application/json",
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "matched": 3,
+        "updated": 3,
+        "deleted": 0,
+        "blocked": 0,
+        "blocked_ids": [],
+    }
+    assert set(
+        Client.objects.filter(tag="new", mobile_operator_code="901").values_list(
+            "id", flat=True
+        )
+    ) == {c.id for c in clients}
+    other_client.refresh_from_db()
+    assert other_client.mobile_operator_code == "900"
+
+
+def test_bulk_delete_clients_skips_clients_with_messages(client):
+    ClientFactory.create_batch(2, phone_number="79000000000")
+    blocked_client = MessageFactory(client__phone_number="79000000001").client
+    other_client = ClientFactory(phone_number="78000000000")
+
+    response = client.delete(reverse("api:client-bulk") + "?phone_number_prefix=79")
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "matched": 3,
+        "updated": 0,
+        "deleted": 2,
+        "blocked": 1,
+        "blocked_ids": [blocked_client.id],
+    }
+    assert set(Client.objects.values_list("id", flat=True)) == {
+        blocked_client.id,
+        other_client.id,
+    }
+
+
+# DRF marks the surrounding transaction for rollback on errors, the test one
+# included
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize(
+    "method, params, data",
+    [
+        ("patch", "", {"tag": "new"}),
+        ("delete", "?phone_number=79000000000", None),
+        ("patch", "?tag=old", {}),
+        ("patch", "?tag=old", {"timezone": "Mars/Olympus"}),
+    ],
+)
+def test_bulk_mutation_rejects_invalid_requests(client, method, params, data):
+    ClientFactory(tag="old")
+
+    response = getattr(client, method)(
+        reverse("api:client-bulk") + params, data, content_type="application/json"
+    )
+
+    assert response.status_code == 400
+    assert Client.objects.filter(tag="old").exists()
+
+
+def test_bulk_mutation_is_not_wrapped_in_a_request_transaction():
+    view = resolve(reverse("api:client-bulk")).func
+
+    assert view._non_atomic_requests == {"default"}
+
+
+def test_bulk_mutation_walks_clients_in_chunks():
+    ClientFactory.create_batch(5, tag="old")
+    mutation = ClientBulkMutation(Client.objects.filter(tag="old"), chunk_size=2)
+
+    # The clients still match the queryset after the update, yet every one
+    # is visited once: 3 chunks and the empty last one, an update per chunk
+    with CaptureQueriesContext(connection) as queries:
+        result = mutation.update({"timezone": "Europe/Moscow"})
+
+    assert (result.matched, result.updated) == (5, 5)
+    assert [query["sql"].split()[0] for query in queries].count("SELECT") == 4
+    assert [query["sql"].split()[0] for query in queries].count("UPDATE") == 3
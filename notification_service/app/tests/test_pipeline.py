@@ -0,0 +1,171 @@
+import asyncio
+import time
+
+import pytest
+
+from notification_service.app.pipeline import MessageSendingPipeline
+from notification_service.utils.batch_size_tuner import AdaptiveBatchSize
+from notification_service.utils.mailing_client import MailingMessage
+
+
+def _make_batches(batches_count: int, batch_size: int) -> list[list[MailingMessage]]:
+    return [
+        [
+            MailingMessage(msg_id=batch * batch_size + i, phone="79000000000", text="")
+            for i in range(batch_size)
+        ]
+        for batch in range(batches_count)
+    ]
+
+
+def _run_pipeline(batches, post_delay: float = 0, **kwargs):
+    posted, flushes, max_send_queue_depth = [], [], 0
+
+    async def read_batches():
+        for batch in batches:
+            yield batch
+
+    async def post_message(message):
+        nonlocal max_send_queue_depth
+        max_send_queue_depth = max(
+            max_send_queue_depth, pipeline.queue_depths()["send"]
+        )
+        await asyncio.sleep(post_delay)
+        posted.append(message.msg_id)
+
+    async def write_results(messages):
+        flushes.append([message.msg_id for message in messages])
+
+    async def run():
+        nonlocal pipeline
+        pipeline = MessageSendingPipeline(
+            read_batches, post_message, write_results, **kwargs
+        )
+        await pipeline.run()
+
+    pipeline = None
+    asyncio.run(run())
+    return pipeline, posted, flushes, max_send_queue_depth
+
+
+def test_pipeline_posts_and_writes_every_message():
+    batches = _make_batches(batches_count=5, batch_size=7)
+
+    pipeline, posted, flushes, _ = _run_pipeline(
+        batches, concurrency=3, flush_size=10, flush_interval=60
+    )
+
+    expected_ids = [message.msg_id for batch in batches for message in batch]
+    assert sorted(posted) == expected_ids
+    assert sorted(msg_id for flush in flushes for msg_id in flush) == expected_ids
+    assert [len(flush) for flush in flushes] == [10, 10, 10, 5]
+    assert pipeline.stats() == {
+        "read": 35,
+        "sent": 35,
+        "skipped": 0,
+        "timed_out": 0,
+        "written": 35,
+        "flush_size": 10,
+        "send_queue_depth": 0,
+        "write_queue_depth": 0,
+    }
+
+
+def test_pipeline_flushes_by_time():
+    batches = _make_batches(batches_count=1, batch_size=4)
+
+    _, _, flushes, _ = _run_pipeline(
+        batches, post_delay=0.02, concurrency=1, flush_size=100, flush_interval=0.01
+    )
+
+    assert len(flushes) > 1
+
+
+def test_pipeline_queues_are_bounded():
+    batches = _make_batches(batches_count=10, batch_size=10)
+
+    _, posted, _, max_send_queue_depth = _run_pipeline(
+        batches, post_delay=0.001, concurrency=2, queue_size=5
+    )
+
+    assert len(posted) == 100
+    assert max_send_queue_depth <= 5
+
+
+def test_pipeline_persists_posted_results_when_a_stage_fails():
+    batches = _make_batches(batches_count=1, batch_size=10)
+    flushes = []
+
+    async def read_batches():
+        for batch in batches:
+            yield batch
+
+    async def post_message(message):
+        if message.msg_id == 5:
+            raise RuntimeError("Unexpected error")
+
+    async def write_results(messages):
+        flushes.append([message.msg_id for message in messages])
+
+    pipeline = MessageSendingPipeline(
+        read_batches,
+        post_message,
+        write_results,
+        concurrency=1,
+        flush_size=100,
+        flush_interval=60,
+    )
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(pipeline.run())
+
+    assert flushes == [[0, 1, 2, 3, 4]]
+
+
+def test_pipeline_cancels_posts_exceeding_the_deadline():
+    batches = _make_batches(batches_count=1, batch_size=3)
+
+    pipeline, posted, flushes, _ = _run_pipeline(
+        batches, post_delay=10, concurrency=3, post_deadline=0.01
+    )
+
+    assert posted == []
+    assert pipeline.stats()["sent"] == 0
+    assert pipeline.stats()["timed_out"] == 3
+    assert sorted(msg_id for flush in flushes for msg_id in flush) == [0, 1, 2]
+
+
+def test_pipeline_writes_back_queued_messages_unposted_after_post_until():
+    batches = _make_batches(batches_count=2, batch_size=5)
+
+    pipeline, posted, flushes, _ = _run_pipeline(
+        batches,
+        post_delay=0.05,
+        concurrency=1,
+        flush_interval=60,
+        post_until=time.monotonic() + 0.12,
+    )
+
+    assert 0 < len(posted) < 10
+    assert sorted(msg_id for flush in flushes for msg_id in flush) == list(range(10))
+    stats = pipeline.stats()
+    assert stats["sent"] == len(posted)
+    assert stats["skipped"] + stats["timed_out"] == 10 - stats["sent"]
+
+
+def test_pipeline_flush_size_follows_the_tuner():
+    batches = _make_batches(batches_count=10, batch_size=10)
+    flush_size_tuner = AdaptiveBatchSize(
+        "flush", initial_size=4, min_size=1, target_latency=60
+    )
+
+    pipeline, _, flushes, _ = _run_pipeline(
+        batches,
+        concurrency=1,
+        flush_interval=60,
+        flush_size_tuner=flush_size_tuner,
+    )
+
+    # Every fast full flush grows the next one
+    assert [len(flush) for flush in flushes][:4] == [4, 6, 9, 13]
+    assert pipeline.stats()["flush_size"] == flush_size_tuner.size
@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta
+
+import pytest
+from django.db import connection
+from django.utils import timezone
+
+from notification_service.app.models import Client, Mailing, Message
+from notification_service.app.services import (
+    MailingStarterService,
+    UpcomingMailingsStarterService,
+)
+from notification_service.app.tests.factories import MailingFactory
+
+pytestmark = pytest.mark.django_db
+
+NOW = timezone.make_aware(datetime(2022, 1, 1))
+MONTH = timedelta(days=30)
+
+
+@pytest.fixture(autouse=True)
+def seeded_database():
+    mailings = [
+        MailingFactory(start_at=NOW - MONTH, finish_at=NOW + MONTH),
+        MailingFactory(start_at=NOW - MONTH * 2, finish_at=NOW - MONTH),
+    ]
+    MailingFactory.create_batch(100, start_at=NOW - MONTH, started_at=NOW - MONTH)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {Client._meta.db_table} "
+            "(phone_number, mobile_operator_code, tag, timezone) "
+            "SELECT '7' || lpad(n::text, 10, '0'), (n %% 50)::text, "
+            "'tag' || (n %% 100)::text, 'UTC' "
+            "FROM generate_series(1, 5000) AS n",
+            [],
+        )
+        # Most of the messages are already handled, like on production
+        cursor.execute(
+            f"INSERT INTO {Message._meta.db_table} "
+            "(created_at, status, attempts, mailing_id, client_id) "
+            "SELECT %s, CASE WHEN n %% 100 = 0 THEN %s WHEN n %% 100 = 1 THEN %s "
+            "ELSE %s END, 0, %s, client.id "
+            f"FROM {Client._meta.db_table} AS client, generate_series(0, 1) AS n",
+            [
+                NOW,
+                Message.Status.PENDING,
+                Message.Status.FAILED,
+                Message.Status.SUCCEED,
+                mailings[0].id,
+            ],
+        )
+        for model in (Mailing, Client, Message):
+            cursor.execute(f"ANALYZE {model._meta.db_table}")
+        # Keep the planner away from sequential scans of the seeded tables
+        # the way it avoids them on production sized tables.
+        cursor.execute("SET LOCAL enable_seqscan = off")
+
+
+@pytest.mark.parametrize("status", [Message.Status.PENDING, Message.Status.FAILED])
+def test_message_dispatch_uses_partial_index(status):
+    messages_qs = Message.objects.filter(status=status, id__gt=0).order_by("id")[:200]
+
+    assert "message_dispatch_idx" in messages_qs.explain()
+
+
+def test_overdue_messages_canceling_uses_partial_index():
+    messages_qs = Message.objects.filter(
+        mailing__finish_at__lt=NOW, status=Message.Status.PENDING
+    )
+
+    assert "message_pending_mailing_idx" in messages_qs.explain()
+
+
+def test_missed_send_windows_lookup_uses_partial_index():
+    messages_qs = Message.objects.filter(
+        eligible_until__lte=NOW,
+        status__in=[Message.Status.PENDING, Message.Status.FAILED],
+    ).values("mailing_id")
+
+    assert "message_send_window_idx" in messages_qs.explain()
+
+
+@pytest.mark.parametrize(
+    "mobile_operator_code, tag, expected_index",
+    [
+        ("12", "tag12", "client_operator_tag_idx"),
+        ("12", None, "client_operator_tag_idx"),
+        (None, "tag12", "client_tag_idx"),
+    ],
+)
+def test_target_clients_use_composite_index(mobile_operator_code, tag, expected_index):
+    mailing = Mailing(mobile_operator_code=mobile_operator_code, tag=tag)
+    target_clients_qs = MailingStarterService._get_target_clients(mailing)
+
+    assert expected_index in target_clients_qs.explain()
+
+
+def test_upcoming_mailings_use_partial_index():
+    upcoming_mailings_starter = UpcomingMailingsStarterService(
+        mailing_starter=lambda mailing_id: None, get_current_datetime=lambda: NOW
+    )
+
+    assert (
+        "mailing_not_started_idx"
+        in upcoming_mailings_starter._get_upcoming_mailings().explain()
+    )
@@ -0,0 +1,60 @@
+from datetime import datetime, time
+
+import pytest
+import pytz
+
+from notification_service.app.send_windows import get_send_window
+
+
+def _utc(*args) -> datetime:
+    return datetime(*args, tzinfo=pytz.utc)
+
+
+@pytest.mark.parametrize(
+    "timezone, window, now, expected_window",
+    [
+        # Inside the window: the current one
+        (
+            "Europe/Moscow",
+            (time(9), time(21)),
+            _utc(2022, 1, 1, 12),
+            (_utc(2022, 1, 1, 6), _utc(2022, 1, 1, 18)),
+        ),
+        # Before and after the window: the next one
+        (
+            "Europe/Moscow",
+            (time(9), time(21)),
+            _utc(2022, 1, 1, 3),
+            (_utc(2022, 1, 1, 6), _utc(2022, 1, 1, 18)),
+        ),
+        (
+            "Europe/Moscow",
+            (time(9), time(21)),
+            _utc(2022, 1, 1, 18),
+            (_utc(2022, 1, 2, 6), _utc(2022, 1, 2, 18)),
+        ),
+        # The local date differs from the UTC one
+        (
+            "Asia/Tokyo",
+            (time(9), time(21)),
+            _utc(2022, 1, 1, 20),
+            (_utc(2022, 1, 2, 0), _utc(2022, 1, 2, 12)),
+        ),
+        # A window past midnight, opened the day before
+        (
+            "UTC",
+            (time(22), time(6)),
+            _utc(2022, 1, 2, 3),
+            (_utc(2022, 1, 1, 22), _utc(2022, 1, 2, 6)),
+        ),
+        # The next window is on the first day of the daylight saving time
+        (
+            "America/New_York",
+            (time(9), time(17)),
+            _utc(2022, 3, 12, 23),
+            (_utc(2022, 3, 13, 13), _utc(2022, 3, 13, 21)),
+        ),
+    ],
+)
+def test_get_send_window(timezone, window, now, expected_window):
+    assert get_send_window(timezone, *window, now) == expected_window
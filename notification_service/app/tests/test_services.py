@@ -1,13 +1,21 @@
-from datetime import datetime, timedelta
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
 from unittest.mock import Mock
 
 import pytest
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
-from notification_service.app.models import Mailing, Message
+from notification_service.app.models import Client, Mailing, Message
+from notification_service.app.retries import RetryPolicy
 from notification_service.app.services import (
     MailingStarterCallable,
     MailingStarterService,
+    MailingStartSchedulerCallable,
+    MailingStartSchedulerService,
     UpcomingMailingsStarterService,
     UpcomingMessagesSenderService,
 )
@@ -17,6 +25,7 @@ from notification_service.app.tests.factories import (
     MessageFactory,
 )
 from notification_service.app.tests.mocks import TestMailingClient
+from notification_service.utils.batch_size_tuner import AdaptiveBatchSize
 
 pytestmark = pytest.mark.django_db
 
@@ -48,6 +57,53 @@ def test_upcoming_mailings_starter_service(settings):
     ] == expected_mailings_ids
 
 
+def test_mailing_start_scheduler_service(django_capture_on_commit_callbacks):
+    mock_mailing_start_scheduler = Mock(spec=MailingStartSchedulerCallable)
+    expected_mailings = [
+        MailingFactory(start_at=NOW - MONTH),
+        MailingFactory(start_at=NOW + timedelta(minutes=30)),
+        # start_at has changed since the start was scheduled
+        MailingFactory(
+            start_at=NOW + timedelta(minutes=10), scheduled_start_at=NOW + MONTH
+        ),
+    ]
+    MailingFactory(
+        start_at=NOW + timedelta(minutes=20),
+        scheduled_start_at=NOW + timedelta(minutes=20),
+    )
+    MailingFactory(start_at=NOW + timedelta(hours=2))
+    MailingFactory(start_at=NOW - MONTH, started_at=NOW - MONTH)
+    MailingFactory(start_at=NOW - MONTH * 2, finish_at=NOW - MONTH)
+    mailing_start_scheduler = MailingStartSchedulerService(
+        mock_mailing_start_scheduler, _get_time_awared_now, horizon=timedelta(hours=1)
+    )
+
+    with django_capture_on_commit_callbacks(execute=True):
+        mailing_start_scheduler.execute()
+        assert not mock_mailing_start_scheduler.called
+    # Once per start_at
+    with django_capture_on_commit_callbacks(execute=True):
+        mailing_start_scheduler.execute()
+
+    assert [
+        call_args[0] for call_args in mock_mailing_start_scheduler.call_args_list
+    ] == [(mailing.id, mailing.start_at) for mailing in expected_mailings]
+
+
+def test_mailing_start_scheduler_service_schedules_given_mailings(
+    django_capture_on_commit_callbacks,
+):
+    mock_mailing_start_scheduler = Mock(spec=MailingStartSchedulerCallable)
+    mailing, _ = MailingFactory.create_batch(2, start_at=NOW)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        MailingStartSchedulerService(
+            mock_mailing_start_scheduler, _get_time_awared_now
+        ).execute([mailing.id])
+
+    mock_mailing_start_scheduler.assert_called_once_with(mailing.id, NOW)
+
+
 def test_mailing_starter_service_ignores_already_handled_mailing():
     now = datetime(2022, 1, 1)
     mailing_starter = MailingStarterService(lambda: now)
@@ -66,9 +122,12 @@ def test_mailing_starter_service_ignores_already_handled_mailing():
     assert not Message.objects.count()
 
 
+@pytest.mark.parametrize("chunk_size", [None, 1, 2])
 @pytest.mark.parametrize("is_empty_tag", [True, False])
 @pytest.mark.parametrize("is_empty_mobile_operator_code", [True, False])
-def test_mailing_starter_service(is_empty_tag, is_empty_mobile_operator_code):
+def test_mailing_starter_service(
+    is_empty_tag, is_empty_mobile_operator_code, chunk_size
+):
     target_tag = "some_tag"
     target_mobile_operator_code = "123"
     for tag in (target_tag, "another_tag"):
@@ -85,7 +144,7 @@ def test_mailing_starter_service(is_empty_tag, is_empty_mobile_operator_code):
         if is_empty_mobile_operator_code
         else target_mobile_operator_code,
     ).id
-    mailing_starter = MailingStarterService(lambda: NOW)
+    mailing_starter = MailingStarterService(lambda: NOW, chunk_size=chunk_size)
     mailing_starter.execute(mailing_id)
 
     created_messages = Message.objects.filter(
@@ -99,9 +158,124 @@ def test_mailing_starter_service(is_empty_tag, is_empty_mobile_operator_code):
             assert message.client.mobile_operator_code == target_mobile_operator_code
         assert created_messages[0].status == Message.Status.PENDING
 
+    assert created_messages.count() == len(
+        {message.client_id for message in created_messages}
+    )
     assert Mailing.objects.get(id=mailing_id).started_at == NOW
 
 
+def test_mailing_starter_service_resumes_from_cursor():
+    clients = ClientFactory.create_batch(5, tag="tag", mobile_operator_code="123")
+    mailing_id = MailingFactory(
+        start_at=NOW - MONTH,
+        tag="tag",
+        mobile_operator_code="123",
+        fanout_cursor=clients[1].id,
+    ).id
+
+    mailing_starter = MailingStarterService(lambda: NOW, chunk_size=2)
+    mailing_starter.execute(mailing_id)
+
+    assert sorted(
+        Message.objects.filter(mailing_id=mailing_id).values_list(
+            "client_id", flat=True
+        )
+    ) == [client.id for client in clients[2:]]
+    assert Mailing.objects.get(id=mailing_id).started_at == NOW
+
+
+def test_mailing_starter_service_commits_chunks_independently():
+    ClientFactory.create_batch(3, tag="tag", mobile_operator_code="123")
+    mailing_id = MailingFactory(
+        start_at=NOW - MONTH, tag="tag", mobile_operator_code="123"
+    ).id
+    mailing_starter = MailingStarterService(lambda: NOW, chunk_size=2)
+
+    assert mailing_starter._start_mailing_chunk(mailing_id)
+    assert Message.objects.filter(mailing_id=mailing_id).count() == 2
+    assert Mailing.objects.get(id=mailing_id).started_at is None
+
+    assert not mailing_starter._start_mailing_chunk(mailing_id)
+    assert Message.objects.filter(mailing_id=mailing_id).count() == 3
+    assert Mailing.objects.get(id=mailing_id).started_at == NOW
+
+
+@pytest.mark.parametrize("chunk_size", [None, 1])
+def test_mailing_starter_service_sends_messages_once_started(chunk_size):
+    ClientFactory.create_batch(2, tag="tag", mobile_operator_code="123")
+    mailing_id = MailingFactory(
+        start_at=NOW - MONTH, tag="tag", mobile_operator_code="123"
+    ).id
+    messages_sender = Mock()
+    mailing_starter = MailingStarterService(
+        lambda: NOW, chunk_size=chunk_size, messages_sender=messages_sender
+    )
+
+    mailing_starter.execute(mailing_id)
+    mailing_starter.execute(mailing_id)
+
+    messages_sender.assert_called_once_with()
+
+
+def test_mailing_starter_service_ignores_start_scheduled_for_changed_start_at():
+    ClientFactory(tag="tag", mobile_operator_code="123")
+    mailing = MailingFactory(start_at=NOW, tag="tag", mobile_operator_code="123")
+    mailing_starter = MailingStarterService(lambda: NOW)
+
+    mailing_starter.execute(mailing.id, start_at=NOW - MONTH)
+    assert not Message.objects.filter(mailing=mailing).exists()
+
+    mailing_starter.execute(mailing.id, start_at=NOW)
+    assert Message.objects.filter(mailing=mailing).exists()
+
+
+@pytest.mark.parametrize("chunk_size", [None, 1])
+def test_mailing_starter_service_places_messages_in_send_windows(chunk_size):
+    moscow_client = ClientFactory(tag="tag", timezone="Europe/Moscow")
+    tokyo_client = ClientFactory(tag="tag", timezone="Asia/Tokyo")
+    unknown_timezone_client = ClientFactory(tag="tag")
+    Client.objects.filter(id=unknown_timezone_client.id).update(timezone="Mars/Olympus")
+    mailing = MailingFactory(
+        start_at=NOW - MONTH,
+        tag="tag",
+        mobile_operator_code=None,
+        send_window_start=time(9),
+        send_window_end=time(21),
+    )
+
+    MailingStarterService(lambda: NOW, chunk_size=chunk_size).execute(mailing.id)
+
+    # Local 03:00 in Moscow waits for the window, local 09:00 in Tokyo is in it
+    assert {
+        client_id: (eligible_from, eligible_until)
+        for client_id, eligible_from, eligible_until in Message.objects.filter(
+            mailing=mailing
+        ).values_list("client_id", "eligible_from", "eligible_until")
+    } == {
+        moscow_client.id: (NOW + timedelta(hours=6), NOW + timedelta(hours=18)),
+        tokyo_client.id: (NOW, NOW + timedelta(hours=12)),
+        unknown_timezone_client.id: (None, None),
+    }
+    assert Mailing.objects.get(id=mailing.id).started_at == NOW
+
+
+@pytest.mark.parametrize("clients_count", [1, 50])
+def test_mailing_starter_service_query_count_does_not_depend_on_audience(
+    django_assert_num_queries, clients_count
+):
+    ClientFactory.create_batch(clients_count, tag="tag", mobile_operator_code="123")
+    mailing_id = MailingFactory(
+        start_at=NOW - MONTH, tag="tag", mobile_operator_code="123"
+    ).id
+    mailing_starter = MailingStarterService(lambda: NOW)
+
+    # savepoint + lock the mailing + fan-out + counters + save the mailing + release
+    with django_assert_num_queries(6):
+        mailing_starter.execute(mailing_id)
+
+    assert Message.objects.filter(mailing_id=mailing_id).count() == clients_count
+
+
 def test_upcoming_messages_sender_service():
     overdue_message = MessageFactory(
         mailing=MailingFactory(start_at=NOW - MONTH * 2, finish_at=NOW - MONTH)
@@ -136,3 +310,560 @@ def test_upcoming_messages_sender_service():
 
         message.refresh_from_db()
         assert message.status == Message.Status.SUCCEED
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_upcoming_messages_senders_do_not_post_twice():
+    mailing = MailingFactory(start_at=NOW - MONTH, finish_at=None)
+    messages = MessageFactory.create_batch(40, mailing=mailing)
+    test_mailing_client = TestMailingClient(post_delay=0.01)
+
+    def send_upcoming_messages():
+        try:
+            UpcomingMessagesSenderService(
+                test_mailing_client, _get_time_awared_now, batch_size=3
+            ).execute()
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for future in [executor.submit(send_upcoming_messages) for _ in range(4)]:
+            future.result()
+
+    assert sorted(
+        posted_message.msg_id for posted_message in test_mailing_client.posted_messages
+    ) == sorted(message.id for message in messages)
+    assert set(
+        Message.objects.filter(mailing=mailing).values_list("status", flat=True)
+    ) == {Message.Status.SUCCEED}
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize("pipelined", [False, True])
+def test_upcoming_messages_sender_service_under_transaction_pooling(
+    transaction_pooling, pipelined
+):
+    mailing = MailingFactory(start_at=NOW - MONTH, finish_at=None)
+    messages = MessageFactory.create_batch(10, mailing=mailing)
+    test_mailing_client = TestMailingClient()
+
+    UpcomingMessagesSenderService(
+        test_mailing_client, _get_time_awared_now, batch_size=3, pipelined=pipelined
+    ).execute()
+
+    assert sorted(
+        posted_message.msg_id for posted_message in test_mailing_client.posted_messages
+    ) == [message.id for message in messages]
+    assert set(
+        Message.objects.filter(mailing=mailing).values_list("status", flat=True)
+    ) == {Message.Status.SUCCEED}
+
+
+def test_upcoming_messages_sender_service_reads_mailing_contents_once():
+    mailings = MailingFactory.create_batch(2, start_at=NOW - MONTH, finish_at=None)
+    for mailing in mailings:
+        MessageFactory.create_batch(3, mailing=mailing)
+    test_mailing_client = TestMailingClient()
+
+    with CaptureQueriesContext(connection) as queries:
+        UpcomingMessagesSenderService(
+            test_mailing_client, _get_time_awared_now, batch_size=2
+        ).execute()
+
+    content_queries = [
+        query
+        for query in queries.captured_queries
+        if query["sql"].startswith('SELECT "app_mailing"."id", "app_mailing"."content"')
+    ]
+    # One read per mailing, the later batches of a mailing reuse it
+    assert len(content_queries) == len(mailings)
+    message_mailing_ids = dict(Message.objects.values_list("id", "mailing_id"))
+    mailing_texts = {}
+    for posted_message in test_mailing_client.posted_messages:
+        mailing_texts.setdefault(message_mailing_ids[posted_message.msg_id], set()).add(
+            id(posted_message.text)
+        )
+    assert {mailing_id: len(texts) for mailing_id, texts in mailing_texts.items()} == {
+        mailing.id: 1 for mailing in mailings
+    }
+
+
+def test_upcoming_messages_sender_service_skips_claimed_messages():
+    mailing = MailingFactory(start_at=NOW - MONTH, finish_at=None)
+    claimed_message = MessageFactory(mailing=mailing, claimed_until=NOW + MONTH)
+    expired_claim_message = MessageFactory(mailing=mailing, claimed_until=NOW - MONTH)
+    test_mailing_client = TestMailingClient()
+
+    UpcomingMessagesSenderService(test_mailing_client, _get_time_awared_now).execute()
+
+    assert [
+        posted_message.msg_id for posted_message in test_mailing_client.posted_messages
+    ] == [expired_claim_message.id]
+    claimed_message.refresh_from_db()
+    assert claimed_message.status == Message.Status.PENDING
+    expired_claim_message.refresh_from_db()
+    assert expired_claim_message.claimed_until is None
+
+
+def test_pipelined_upcoming_messages_sender_service():
+    mailing = MailingFactory(start_at=NOW - MONTH, finish_at=None)
+    messages = MessageFactory.create_batch(10, mailing=mailing)
+    test_mailing_client = TestMailingClient(post_delay=0.001)
+
+    UpcomingMessagesSenderService(
+        test_mailing_client,
+        _get_time_awared_now,
+        batch_size=3,
+        pipelined=True,
+        concurrency=4,
+        flush_size=4,
+    ).execute()
+
+    assert sorted(
+        posted_message.msg_id for posted_message in test_mailing_client.posted_messages
+    ) == [message.id for message in messages]
+    assert list(
+        Message.objects.filter(mailing=mailing).values_list("status", "sent_at")
+    ) == [(Message.Status.SUCCEED, NOW)] * len(messages)
+
+
+def test_upcoming_messages_sender_service_pipeline_posters_follow_the_window():
+    mailing = MailingFactory(start_at=NOW - MONTH, finish_at=None)
+    MessageFactory.create_batch(20, mailing=mailing)
+    test_mailing_client = TestMailingClient(post_delay=0.01, max_concurrency=8)
+
+    UpcomingMessagesSenderService(
+        test_mailing_client,
+        _get_time_awared_now,
+        batch_size=10,
+        pipelined=True,
+        concurrency=2,
+    ).execute()
+
+    # The client's adaptive window, not `concurrency`, bounds the posts
+    assert test_mailing_client.max_in_flight == 8
+    assert len(test_mailing_client.posted_messages) == 20
+
+
+def test_upcoming_messages_sender_service_tunes_the_claimed_batches(monkeypatch):
+    mailing = MailingFactory(start_at=NOW - MONTH, finish_at=None)
+    MessageFactory.create_batch(20, mailing=mailing)
+    claimed_batch_sizes = []
+    claim_message_batch = UpcomingMessagesSenderService._claim_message_batch
+
+    def record_claimed_batch(self, batch_size, *args):
+        claimed_batch_sizes.append(batch_size)
+        return claim_message_batch(self, batch_size, *args)
+
+    monkeypatch.setattr(
+        UpcomingMessagesSenderService, "_claim_message_batch", record_claimed_batch
+    )
+
+    UpcomingMessagesSenderService(
+        TestMailingClient(),
+        _get_time_awared_now,
+        batch_size_tuner=AdaptiveBatchSize(
+            "claim batch", initial_size=2, min_size=1, target_latency=60
+        ),
+    ).execute()
+
+    # Full batches grow the next claims, the partial and the empty ones do not
+    assert claimed_batch_sizes == [2, 3, 4, 6, 10, 10, 10]
+    assert set(
+        Message.objects.filter(mailing=mailing).values_list("status", flat=True)
+    ) == {Message.Status.SUCCEED}
+
+
+def test_upcoming_messages_sender_service_writes_back_by_flush_size(monkeypatch):
+    mailing = MailingFactory(start_at=NOW - MONTH, finish_at=None)
+    MessageFactory.create_batch(10, mailing=mailing)
+    flush_sizes = []
+    update_sent_messages = UpcomingMessagesSenderService._update_sent_messages
+
+    def record_flush(self, mailing_messages):
+        flush_sizes.append(len(mailing_messages))
+        return update_sent_messages(self, mailing_messages)
+
+    monkeypatch.setattr(
+        UpcomingMessagesSenderService, "_update_sent_messages", record_flush
+    )
+
+    UpcomingMessagesSenderService(
+        TestMailingClient(), _get_time_awared_now, batch_size=5, flush_size=2
+    ).execute()
+
+    assert flush_sizes == [2, 2, 1, 2, 2, 1]
+    assert set(
+        Message.objects.filter(mailing=mailing).values_list("status", flat=True)
+    ) == {Message.Status.SUCCEED}
+
+
+@pytest.mark.parametrize(
+    "previous_attempts, expected_status, expected_delay",
+    [
+        (0, Message.Status.FAILED, timedelta(seconds=10)),
+        (2, Message.Status.FAILED, timedelta(seconds=40)),
+        (3, Message.Status.UNDELIVERED, timedelta(seconds=80)),
+    ],
+)
+def test_upcoming_messages_sender_service_retries_failed_messages(
+    previous_attempts, expected_status, expected_delay
+):
+    mailing = MailingFactory(start_at=NOW - MONTH, finish_at=None)
+    message = MessageFactory(
+        mailing=mailing,
+        status=Message.Status.FAILED if previous_attempts else Message.Status.PENDING,
+        attempts=previous_attempts,
+        next_attempt_at=NOW if previous_attempts else None,
+    )
+    test_mailing_client = TestMailingClient(
+        failing_phones={message.client.phone_number}
+    )
+
+    UpcomingMessagesSenderService(
+        test_mailing_client,
+        _get_time_awared_now,
+        retry_policy=RetryPolicy(
+            max_attempts=4, base_delay=timedelta(seconds=10), jitter=0
+        ),
+    ).execute()
+
+    message.refresh_from_db()
+    assert message.status == expected_status
+    assert message.attempts == previous_attempts + 1
+    assert message.next_attempt_at == NOW + expected_delay
+    assert message.claimed_until is None
+
+
+def test_upcoming_messages_sender_service_caps_and_jitters_retry_delays():
+    mailing = MailingFactory(start_at=NOW - MONTH, finish_at=None)
+    messages = [
+        MessageFactory(
+            mailing=mailing,
+            status=Message.Status.FAILED,
+            attempts=previous_attempts,
+            next_attempt_at=NOW,
+        )
+        for previous_attempts in range(7)
+        for _ in range(3)
+    ]
+    test_mailing_client = TestMailingClient(
+        failing_phones={message.client.phone_number for message in messages}
+    )
+
+    UpcomingMessagesSenderService(
+        test_mailing_client,
+        _get_time_awared_now,
+        retry_policy=RetryPolicy(
+            max_attempts=10,
+            base_delay=timedelta(seconds=10),
+            max_delay=timedelta(seconds=100),
+            jitter=0.5,
+        ),
+    ).execute()
+
+    delays: dict[int, list[float]] = {}
+    for message in Message.objects.filter(mailing=mailing):
+        assert message.status == Message.Status.FAILED
+        delays.setdefault(message.attempts - 1, []).append(
+            (message.next_attempt_at - NOW).total_seconds()
+        )
+    # 10, 20, 40, 80, then capped at 100, shortened by up to half at random
+    for previous_attempts, full_delay in enumerate([10, 20, 40, 80, 100, 100, 100]):
+        assert all(
+            full_delay * 0.5 <= delay <= full_delay
+            for delay in delays[previous_attempts]
+        )
+    assert len({delay for delay in sum(delays.values(), [])}) > 7
+
+
+@pytest.mark.parametrize("pipelined", [False, True])
+def test_upcoming_messages_sender_service_delays_retries_from_write_back(pipelined):
+    message = MessageFactory(
+        mailing=MailingFactory(start_at=NOW - MONTH, finish_at=None)
+    )
+    current_time = NOW
+
+    class SlowMailingClient(TestMailingClient):
+        async def post_message(self, message):
+            nonlocal current_time
+            await super().post_message(message)
+            current_time += timedelta(hours=1)
+
+    test_mailing_client = SlowMailingClient(
+        failing_phones={message.client.phone_number}
+    )
+
+    UpcomingMessagesSenderService(
+        test_mailing_client,
+        lambda: current_time,
+        pipelined=pipelined,
+        retry_policy=RetryPolicy(base_delay=timedelta(seconds=10), jitter=0),
+    ).execute()
+
+    assert len(test_mailing_client.posted_messages) == 1
+    message.refresh_from_db()
+    assert message.status == Message.Status.FAILED
+    assert message.attempts == 1
+    assert message.sent_at == NOW + timedelta(hours=1)
+    assert message.next_attempt_at == NOW + timedelta(hours=1, seconds=10)
+
+
+def test_upcoming_messages_sender_service_sends_fresh_messages_before_retries():
+    mailing = MailingFactory(start_at=NOW - MONTH, finish_at=None)
+    retried_message = MessageFactory(
+        mailing=mailing, status=Message.Status.FAILED, attempts=1, next_attempt_at=NOW
+    )
+    not_due_message = MessageFactory(
+        mailing=mailing,
+        status=Message.Status.FAILED,
+        attempts=1,
+        next_attempt_at=NOW + MONTH,
+    )
+    fresh_message = MessageFactory(mailing=mailing)
+    test_mailing_client = TestMailingClient()
+
+    UpcomingMessagesSenderService(test_mailing_client, _get_time_awared_now).execute()
+
+    assert [
+        posted_message.msg_id for posted_message in test_mailing_client.posted_messages
+    ] == [fresh_message.id, retried_message.id]
+    not_due_message.refresh_from_db()
+    assert not_due_message.status == Message.Status.FAILED
+    assert not_due_message.attempts == 1
+
+
+@pytest.mark.parametrize("pipelined", [False, True])
+def test_upcoming_messages_sender_service_releases_messages_exceeding_deadline(
+    pipelined,
+):
+    mailing = MailingFactory(start_at=NOW - MONTH, finish_at=None)
+    sent_message, hanging_message = MessageFactory.create_batch(2, mailing=mailing)
+    test_mailing_client = TestMailingClient(
+        hanging_phones={hanging_message.client.phone_number}
+    )
+
+    UpcomingMessagesSenderService(
+        test_mailing_client,
+        _get_time_awared_now,
+        pipelined=pipelined,
+        batch_deadline=0.05,
+    ).execute()
+
+    sent_message.refresh_from_db()
+    assert sent_message.status == Message.Status.SUCCEED
+    hanging_message.refresh_from_db()
+    assert hanging_message.status == Message.Status.PENDING
+    assert hanging_message.attempts == 0
+    assert hanging_message.claimed_until is None
+
+
+def test_upcoming_messages_sender_service_writes_back_outcomes_by_sets():
+    mailing = MailingFactory(start_at=NOW - MONTH, finish_at=None)
+    messages = MessageFactory.create_batch(20, mailing=mailing)
+    failed_messages, hanging_messages = messages[:3], messages[-2:]
+    test_mailing_client = TestMailingClient(
+        failing_phones={message.client.phone_number for message in failed_messages},
+        hanging_phones={message.client.phone_number for message in hanging_messages},
+    )
+
+    with CaptureQueriesContext(connection) as queries:
+        UpcomingMessagesSenderService(
+            test_mailing_client,
+            _get_time_awared_now,
+            batch_size=len(messages),
+            batch_deadline=0.05,
+        ).execute()
+
+    # Whatever the batch size: the claim, the counted status changes of the
+    # succeeded and the failed messages and the release of the unsent ones
+    assert [
+        query["sql"].split()[0]
+        for query in queries.captured_queries
+        if re.search(r'"app_message"\."id" IN \(\d', query["sql"])
+    ] == ["UPDATE", "WITH", "WITH", "UPDATE"]
+    assert dict(
+        Message.objects.filter(mailing=mailing)
+        .values_list("status")
+        .annotate(count=Count("id"))
+    ) == {
+        Message.Status.SUCCEED: 15,
+        Message.Status.FAILED: 3,
+        Message.Status.PENDING: 2,
+    }
+
+
+def test_upcoming_messages_sender_service_respects_send_windows():
+    mailing = MailingFactory(
+        start_at=NOW - MONTH,
+        finish_at=None,
+        send_window_start=time(9),
+        send_window_end=time(21),
+    )
+    open_window_message = MessageFactory(
+        mailing=mailing,
+        eligible_from=NOW - timedelta(hours=1),
+        eligible_until=NOW + timedelta(hours=1),
+    )
+    future_window_message = MessageFactory(
+        mailing=mailing,
+        eligible_from=NOW + timedelta(hours=1),
+        eligible_until=NOW + timedelta(hours=2),
+    )
+    # Missed the windows of the previous day: the next Moscow window opens at
+    # 06:00 UTC, the Tokyo one is open
+    missed_window_messages = [
+        MessageFactory(
+            mailing=mailing,
+            client__timezone=timezone,
+            eligible_from=NOW - timedelta(hours=20),
+            eligible_until=NOW - timedelta(hours=10),
+        )
+        for timezone in ("Europe/Moscow", "Asia/Tokyo")
+    ]
+    test_mailing_client = TestMailingClient()
+
+    UpcomingMessagesSenderService(test_mailing_client, _get_time_awared_now).execute()
+
+    assert [
+        posted_message.msg_id for posted_message in test_mailing_client.posted_messages
+    ] == [open_window_message.id, missed_window_messages[1].id]
+    assert {
+        message_id: (status, eligible_from, eligible_until)
+        for message_id, status, eligible_from, eligible_until in Message.objects.filter(
+            id__in=[future_window_message.id, missed_window_messages[0].id]
+        ).values_list("id", "status", "eligible_from", "eligible_until")
+    } == {
+        future_window_message.id: (
+            Message.Status.PENDING,
+            NOW + timedelta(hours=1),
+            NOW + timedelta(hours=2),
+        ),
+        missed_window_messages[0].id: (
+            Message.Status.PENDING,
+            NOW + timedelta(hours=6),
+            NOW + timedelta(hours=18),
+        ),
+    }
+
+
+def test_upcoming_messages_sender_service_sends_messages_of_removed_send_windows():
+    mailing = MailingFactory(start_at=NOW - MONTH, finish_at=None)
+    missed_window_message = MessageFactory(
+        mailing=mailing,
+        eligible_from=NOW - timedelta(hours=20),
+        eligible_until=NOW - timedelta(hours=10),
+    )
+    windowed_mailing = MailingFactory(
+        start_at=NOW - MONTH,
+        finish_at=None,
+        send_window_start=time(9),
+        send_window_end=time(21),
+    )
+    windowed_message = MessageFactory(
+        mailing=windowed_mailing,
+        client__timezone="Asia/Tokyo",
+        eligible_from=NOW - timedelta(hours=20),
+        eligible_until=NOW - timedelta(hours=10),
+    )
+    test_mailing_client = TestMailingClient()
+
+    UpcomingMessagesSenderService(test_mailing_client, _get_time_awared_now).execute()
+
+    assert [
+        posted_message.msg_id for posted_message in test_mailing_client.posted_messages
+    ] == [missed_window_message.id, windowed_message.id]
+    assert Message.objects.filter(
+        id=missed_window_message.id, eligible_from=None, eligible_until=None
+    ).exists()
+
+
+@pytest.mark.parametrize("pipelined", [False, True])
+def test_upcoming_messages_sender_service_stops_claiming_out_of_time(pipelined):
+    mailing = MailingFactory(start_at=NOW - MONTH, finish_at=None)
+    messages = MessageFactory.create_batch(5, mailing=mailing)
+    test_mailing_client = TestMailingClient()
+
+    out_of_time = UpcomingMessagesSenderService(
+        test_mailing_client,
+        _get_time_awared_now,
+        batch_size=2,
+        pipelined=pipelined,
+        batch_deadline=10,
+        run_time_budget=0,
+    ).execute()
+
+    assert out_of_time
+    assert [
+        posted_message.msg_id for posted_message in test_mailing_client.posted_messages
+    ] == [message.id for message in messages[:2]]
+    assert (
+        list(Message.objects.order_by("id").values_list("status", "claimed_until"))
+        == [(Message.Status.SUCCEED, None)] * 2 + [(Message.Status.PENDING, None)] * 3
+    )
+
+
+@pytest.mark.parametrize("pipelined", [False, True])
+def test_partitioned_upcoming_messages_senders_send_their_slices(pipelined):
+    mailing = MailingFactory(start_at=NOW - MONTH, finish_at=None)
+    messages = MessageFactory.create_batch(10, mailing=mailing)
+    overdue_messages = MessageFactory.create_batch(
+        3, mailing=MailingFactory(start_at=NOW - MONTH * 2, finish_at=NOW - MONTH)
+    )
+    posted_ids = []
+
+    for partition in range(3):
+        test_mailing_client = TestMailingClient()
+        UpcomingMessagesSenderService(
+            test_mailing_client,
+            _get_time_awared_now,
+            pipelined=pipelined,
+            partition=partition,
+            partitions=3,
+        ).execute()
+
+        partition_ids = [
+            posted_message.msg_id
+            for posted_message in test_mailing_client.posted_messages
+        ]
+        assert {message_id % 3 for message_id in partition_ids} <= {partition}
+        posted_ids += partition_ids
+        assert Message.objects.filter(
+            id__in=[message.id for message in overdue_messages],
+            status=Message.Status.CANCELED,
+        ).count() == len(
+            [message for message in overdue_messages if message.id % 3 <= partition]
+        )
+
+    assert sorted(posted_ids) == [message.id for message in messages]
+
+
+def test_services_keep_mailing_status_counters():
+    ClientFactory.create_batch(4, tag="tag", mobile_operator_code="123")
+    mailing = MailingFactory(
+        start_at=NOW - MONTH, finish_at=None, tag="tag", mobile_operator_code="123"
+    )
+    overdue_message = MessageFactory(
+        mailing=MailingFactory(start_at=NOW - MONTH * 2, finish_at=NOW - MONTH)
+    )
+    MailingStarterService(lambda: NOW, chunk_size=3).execute(mailing.id)
+    failing_phone = Message.objects.filter(mailing=mailing).first().client.phone_number
+
+    UpcomingMessagesSenderService(
+        TestMailingClient(failing_phones={failing_phone}), _get_time_awared_now
+    ).execute()
+
+    assert Mailing.objects.filter(id=mailing.id).stats() == {
+        Message.Status.PENDING: 0,
+        Message.Status.SUCCEED: 3,
+        Message.Status.FAILED: 1,
+        Message.Status.CANCELED: 0,
+        Message.Status.UNDELIVERED: 0,
+    }
+    assert Mailing.objects.filter(id=overdue_message.mailing_id).stats() == {
+        Message.Status.PENDING: 0,
+        Message.Status.SUCCEED: 0,
+        Message.Status.FAILED: 0,
+        Message.Status.CANCELED: 1,
+        Message.Status.UNDELIVERED: 0,
+    }
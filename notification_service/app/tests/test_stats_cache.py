@@ -0,0 +1,90 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from django.core.cache import cache
+from django.urls import reverse
+
+from notification_service.app.models import Message
+from notification_service.app.stats_cache import (
+    get_mailing_stats,
+    get_mailings_stats,
+    invalidate_mailing_stats,
+)
+from notification_service.app.tests.factories import MailingFactory, MessageFactory
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+class CountingCompute:
+    def __init__(self, delay: float = 0):
+        self.calls = 0
+        self.delay = delay
+
+    def __call__(self) -> dict:
+        self.calls += 1
+        time.sleep(self.delay)
+        return {"calls": self.calls}
+
+
+def test_stats_are_cached_until_invalidated():
+    compute = CountingCompute()
+
+    assert get_mailing_stats(1, compute) == {"calls": 1}
+    assert get_mailing_stats(1, compute) == {"calls": 1}
+    assert get_mailings_stats({}, compute) == {"calls": 2}
+    assert get_mailings_stats({"tag": ["tag"]}, compute) == {"calls": 3}
+
+    invalidate_mailing_stats([2])
+    assert get_mailing_stats(1, compute) == {"calls": 1}
+    assert get_mailings_stats({}, compute) == {"calls": 4}
+
+    invalidate_mailing_stats([1])
+    assert get_mailing_stats(1, compute) == {"calls": 5}
+
+
+def test_stats_caching_can_be_disabled(settings):
+    settings.MAILING_STATS_CACHE_TTL = 0
+    compute = CountingCompute()
+
+    get_mailing_stats(1, compute)
+    get_mailing_stats(1, compute)
+
+    assert compute.calls == 2
+
+
+def test_concurrent_stats_requests_compute_once():
+    compute = CountingCompute(delay=0.2)
+
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        results = list(executor.map(lambda _: get_mailing_stats(1, compute), range(10)))
+
+    assert compute.calls == 1
+    assert results == [{"calls": 1}] * 10
+
+
+@pytest.mark.django_db
+def test_message_changes_invalidate_mailing_stats(
+    client, django_capture_on_commit_callbacks
+):
+    mailing = MailingFactory()
+    url = reverse("api:mailing-detail-stats", kwargs={"pk": mailing.id})
+    with django_capture_on_commit_callbacks(execute=True):
+        message = MessageFactory(mailing=mailing)
+    assert client.get(url).json()["message_statuses"]["Pending"] == 1
+
+    with django_capture_on_commit_callbacks(execute=True):
+        Message.objects.filter(id=message.id).update(status=Message.Status.SUCCEED)
+
+    assert client.get(url).json()["message_statuses"] == {
+        "Pending": 0,
+        "Succeed": 1,
+        "Failed": 0,
+        "Canceled": 0,
+        "Undelivered": 0,
+    }
@@ -0,0 +1,120 @@
+import asyncio
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+from asgiref.sync import async_to_sync
+from fakeredis import FakeRedis, FakeServer
+
+from notification_service.app import tasks
+from notification_service.utils.task_lock import RedisLease
+
+
+@pytest.fixture(autouse=True)
+def task_lock_redis():
+    tasks._get_task_lock_redis.cache_clear()
+    yield
+    tasks._get_task_lock_redis.cache_clear()
+
+
+@pytest.mark.parametrize("max_runs, expected_runs", [(1, 0), (2, 1)])
+def test_overlapping_sender_runs_are_skipped(
+    settings, monkeypatch, max_runs, expected_runs
+):
+    redis_server = FakeServer()
+    monkeypatch.setattr(
+        tasks.SyncRedis, "from_url", lambda url: FakeRedis(server=redis_server)
+    )
+    mock_sender_service = Mock()
+    mock_sender_service.return_value.execute.return_value = False
+    monkeypatch.setattr(tasks, "UpcomingMessagesSenderService", mock_sender_service)
+    settings.MAILING_TASK_LOCK_REDIS_URL = "redis://redis:6379/0"
+    settings.MAILING_SENDER_MAX_RUNS = max_runs
+    running_lease = RedisLease(
+        redis=FakeRedis(server=redis_server),
+        name="task-lease:_send_upcoming_messages_partition:0:1",
+        slots=max_runs,
+    )
+    assert running_lease.acquire()
+
+    tasks.send_upcoming_messages()
+    running_lease.release()
+
+    assert mock_sender_service.return_value.execute.call_count == expected_runs
+
+
+def test_sending_is_fanned_out_to_partitions(settings, monkeypatch):
+    mock_group = Mock()
+    monkeypatch.setattr(tasks, "group", mock_group)
+    settings.MAILING_SENDER_PARTITIONS = 3
+
+    tasks.send_upcoming_messages()
+
+    assert list(mock_group.call_args[0][0]) == [
+        tasks.send_upcoming_messages_partition.s(partition, 3) for partition in range(3)
+    ]
+    mock_group.return_value.apply_async.assert_called_once_with()
+
+
+@pytest.mark.parametrize("out_of_time", [False, True])
+def test_sender_runs_out_of_time_are_continued(settings, monkeypatch, out_of_time):
+    mock_sender_service = Mock()
+    mock_sender_service.return_value.execute.return_value = out_of_time
+    monkeypatch.setattr(tasks, "UpcomingMessagesSenderService", mock_sender_service)
+    mock_delay = Mock()
+    monkeypatch.setattr(tasks.send_upcoming_messages_partition, "delay", mock_delay)
+    settings.MAILING_TASK_LOCK_REDIS_URL = ""
+
+    tasks.send_upcoming_messages_partition(1, 3)
+
+    assert mock_delay.call_args_list == ([((1, 3),)] if out_of_time else [])
+
+
+def test_task_runs_share_the_lock_redis_client(settings, monkeypatch):
+    redis_server = FakeServer()
+    mock_from_url = Mock(side_effect=lambda url: FakeRedis(server=redis_server))
+    monkeypatch.setattr(tasks.SyncRedis, "from_url", mock_from_url)
+    monkeypatch.setattr(tasks, "UpcomingMailingsStarterService", Mock())
+    monkeypatch.setattr(tasks, "schedule_mailing_starts", Mock())
+    settings.MAILING_TASK_LOCK_REDIS_URL = "redis://redis:6379/0"
+
+    tasks.start_upcoming_mailings()
+    tasks.start_upcoming_mailings()
+
+    mock_from_url.assert_called_once_with("redis://redis:6379/0")
+
+
+def test_sender_runs_share_the_concurrency_window(settings):
+    tasks._get_concurrency_limiter.cache_clear()
+    settings.MAILING_CLIENT_ADAPTIVE_CONCURRENCY = True
+    settings.MAILING_CLIENT_INITIAL_CONCURRENCY = 8
+
+    concurrency_limiter = tasks._create_mailing_client(Mock())._concurrency_limiter
+    assert concurrency_limiter is not None
+    concurrency_limiter.on_overload()
+
+    assert tasks._create_mailing_client(Mock()).concurrency_window == 4
+    tasks._get_concurrency_limiter.cache_clear()
+
+
+def test_sender_run_closes_the_redis_rate_limiter_in_its_event_loop(
+    settings, monkeypatch
+):
+    loops = []
+
+    async def record_loop(*args, **kwargs):
+        loops.append(asyncio.get_running_loop())
+
+    redis = Mock(close=AsyncMock(side_effect=record_loop))
+    monkeypatch.setattr(tasks.Redis, "from_url", lambda url: redis)
+    mock_sender_service = Mock()
+    mock_sender_service.return_value.execute.side_effect = lambda: bool(
+        async_to_sync(record_loop)()
+    )
+    monkeypatch.setattr(tasks, "UpcomingMessagesSenderService", mock_sender_service)
+    settings.MAILING_RATE_LIMITER_REDIS_URL = "redis://redis:6379/1"
+
+    tasks.send_upcoming_messages_partition(0, 1)
+
+    redis.close.assert_awaited_once_with(close_connection_pool=True)
+    # The service and the rate limiter closing share the event loop
+    assert len(loops) == 2 and loops[0] is loops[1]
@@ -0,0 +1,272 @@
+import csv
+import gzip
+import json
+import tracemalloc
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from notification_service.app.exports import EXPORT_CHUNK_SIZE
+from notification_service.app.models import Message
+from notification_service.app.tests.factories import (
+    ClientFactory,
+    MailingFactory,
+    MessageFactory,
+)
+
+pytestmark = pytest.mark.django_db
+
+NOW = timezone.make_aware(datetime(2022, 1, 1))
+
+
+def _get_all_pages(client, url, params) -> list[int]:
+    ids = []
+    while url:
+        response = client.get(url, params).json()
+        ids += [item["id"] for item in response["results"]]
+        url, params = response["next"], None
+    return ids
+
+
+def test_messages_cursor_pagination_is_stable_under_inserts(client):
+    mailing = MailingFactory()
+    messages = MessageFactory.create_batch(5, mailing=mailing)
+    url = reverse("api:message-list")
+
+    first_page = client.get(url, {"page_size": 2}).json()
+    MessageFactory.create_batch(3, mailing=mailing)
+    next_ids = _get_all_pages(client, first_page["next"], None)
+
+    assert [item["id"] for item in first_page["results"]] + next_ids == [
+        message.id for message in reversed(messages)
+    ]
+
+
+def test_messages_pages_do_not_count_rows(client):
+    MessageFactory.create_batch(3)
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(reverse("api:message-list"), {"page_size": 2})
+
+    assert response.status_code == 200
+    assert "count" not in response.json()
+    assert not [query for query in queries if "COUNT(" in query["sql"]]
+
+
+def test_messages_filters(client):
+    mailing = MailingFactory()
+    message_client = ClientFactory()
+    expected_message = MessageFactory(
+        mailing=mailing, client=message_client, status=Message.Status.FAILED
+    )
+    MessageFactory(mailing=mailing, client=message_client)
+    MessageFactory(mailing=mailing, status=Message.Status.FAILED)
+    MessageFactory(client=message_client, status=Message.Status.FAILED)
+    Message.objects.filter(id=expected_message.id).update(created_at=NOW)
+    MessageFactory(mailing=mailing, client=message_client, status="Failed")
+
+    ids = _get_all_pages(
+        client,
+        reverse("api:message-list"),
+        {
+            "mailing": mailing.id,
+            "client": message_client.id,
+            "status": "Failed",
+            "created_at_after": (NOW - timedelta(days=1)).isoformat(),
+            "created_at_before": (NOW + timedelta(days=1)).isoformat(),
+        },
+    )
+
+    assert ids == [expected_message.id]
+
+
+def test_clients_filters(client):
+    expected_client = ClientFactory(tag="tag", mobile_operator_code="123")
+    ClientFactory(tag="tag", mobile_operator_code="456")
+    ClientFactory(tag="other", mobile_operator_code="123")
+
+    ids = _get_all_pages(
+        client,
+        reverse("api:client-list"),
+        {"tag": "tag", "mobile_operator_code": "123"},
+    )
+
+    assert ids == [expected_client.id]
+
+
+@pytest.mark.parametrize(
+    "params",
+    [{"status": "Unknown"}, {"mailing": "abc"}, {"created_at_after": "yesterday"}],
+)
+def test_invalid_filters_are_rejected(client, params):
+    response = client.get(reverse("api:message-list"), params)
+
+    assert response.status_code == 400
+    assert set(response.json()) == set(params)
+
+
+@pytest.mark.parametrize(
+    "send_window, expected_status",
+    [
+        ({"send_window_start": "09:00", "send_window_end": "21:00"}, 201),
+        ({"send_window_start": "22:00", "send_window_end": "06:00"}, 201),
+        ({"send_window_start": "09:00"}, 400),
+        ({"send_window_start": "09:00", "send_window_end": "09:00"}, 400),
+    ],
+)
+def test_mailing_send_window_validation(client, send_window, expected_status):
+    response = client.post(
+        reverse("api:mailing-list"),
+        {"start_at": NOW.isoformat(), "content": "content", **send_window},
+        content_type="application/json",
+    )
+
+    assert response.status_code == expected_status
+
+
+def test_mailing_changes_schedule_its_start(
+    client, monkeypatch, django_capture_on_commit_callbacks
+):
+    mock_apply_async = Mock()
+    monkeypatch.setattr(
+        "notification_service.app.tasks.start_mailing.apply_async", mock_apply_async
+    )
+    start_at = timezone.now() + timedelta(minutes=10)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        mailing_id = client.post(
+            reverse("api:mailing-list"),
+            {"start_at": start_at.isoformat(), "content": "content"},
+            content_type="application/json",
+        ).json()["id"]
+    with django_capture_on_commit_callbacks(execute=True):
+        client.patch(
+            reverse("api:mailing-detail", kwargs={"pk": mailing_id}),
+            {"content": "another content"},
+            content_type="application/json",
+        )
+    with django_capture_on_commit_callbacks(execute=True):
+        client.patch(
+            reverse("api:mailing-detail", kwargs={"pk": mailing_id}),
+            {"start_at": (start_at + timedelta(days=1)).isoformat()},
+            content_type="application/json",
+        )
+
+    # The last start_at is beyond the horizon, it is left to the sweeps
+    mock_apply_async.assert_called_once_with(
+        (mailing_id, start_at.isoformat()), eta=start_at
+    )
+
+
+def _create_mailing_messages(mailing, count: int):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {Message._meta.db_table} "
+            "(created_at, status, attempts, mailing_id, client_id) "
+            "SELECT %s, %s, 0, %s, %s FROM generate_series(1, %s)",
+            [NOW, Message.Status.SUCCEED, mailing.id, ClientFactory().id, count],
+        )
+
+
+def _read_export(client, url) -> bytes:
+    response = client.get(url)
+    assert response.status_code == 200
+    return b"".join(response.streaming_content)
+
+
+def test_export_mailing_messages_ndjson(client):
+    message = MessageFactory(sent_at=NOW)
+    MessageFactory()
+
+    content = _read_export(
+        client,
+        reverse(
+            "api:mailing-export-messages",
+            kwargs={"pk": message.mailing_id, "export_format": "ndjson"},
+        ),
+    )
+
+    assert [json.loads(line) for line in content.splitlines()] == [
+        {
+            "id": message.id,
+            "client": message.client_id,
+            "phone_number": message.client.phone_number,
+            "status": "Pending",
+            "attempts": 0,
+            "created_at": message.created_at.isoformat(timespec="milliseconds")[:-6]
+            + "Z",
+            "sent_at": "2022-01-01T00:00:00Z",
+        }
+    ]
+
+
+def test_export_mailing_messages_csv_gzip(client):
+    message = MessageFactory()
+
+    content = _read_export(
+        client, f"/api/mailings/{message.mailing_id}/messages.csv.gz/"
+    )
+
+    assert list(csv.reader(gzip.decompress(content).decode().splitlines())) == [
+        ["id", "client", "phone_number", "status", "attempts", "created_at", "sent_at"],
+        [
+            str(message.id),
+            str(message.client_id),
+            message.client.phone_number,
+            "Pending",
+            "0",
+            message.created_at.isoformat(timespec="milliseconds")[:-6] + "Z",
+            "",
+        ],
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_export_mailing_messages_holds_no_cursor(client, transaction_pooling):
+    mailing = MailingFactory()
+    _create_mailing_messages(mailing, EXPORT_CHUNK_SIZE * 2 + 1)
+
+    response = client.get(f"/api/mailings/{mailing.id}/messages.ndjson/")
+    chunks = iter(response.streaming_content)
+    content = next(chunks)
+
+    # Nothing outlives a transaction while the response is streamed
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM pg_cursors")
+        assert cursor.fetchone() == (0,)
+    assert not connection.in_atomic_block
+    content += b"".join(chunks)
+    assert [json.loads(line)["id"] for line in content.splitlines()] == list(
+        Message.objects.filter(mailing=mailing)
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+
+
+def test_export_unknown_mailing_messages(client):
+    assert client.get("/api/mailings/0/messages.csv/").status_code == 404
+
+
+def test_export_mailing_messages_memory_is_flat(client):
+    def measure_export(messages_count: int) -> int:
+        mailing = MailingFactory()
+        _create_mailing_messages(mailing, messages_count)
+        response = client.get(f"/api/mailings/{mailing.id}/messages.ndjson/")
+        tracemalloc.start()
+        try:
+            exported = sum(chunk.count(b"\n") for chunk in response.streaming_content)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert exported == messages_count
+        return peak
+
+    small_export_peak = measure_export(4_000)
+    large_export_peak = measure_export(40_000)
+
+    assert large_export_peak < small_export_peak * 1.5
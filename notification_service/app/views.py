@@ -1,45 +1,186 @@
-from drf_spectacular.utils import extend_schema
+import io
+
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from drf_spectacular.utils import OpenApiParameter, extend_schema
 from rest_framework import viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import UnsupportedMediaType, ValidationError
+from rest_framework.generics import GenericAPIView
 from rest_framework.response import Response
 
+from .exports import RENDERERS, encode_chunks, iter_mailing_messages
+from .imports import READERS, ClientImporter
 from .models import Client, Mailing, Message
+from .mutations import ClientBulkMutation
 from .serializers import (
+    ClientBulkMutationResultSerializer,
+    ClientBulkUpdateSerializer,
+    ClientImportResultSerializer,
     ClientSerializer,
     MailingSerializer,
     MailingsStatsSerializer,
     MailingStatsSerializer,
     MessageSerializer,
 )
+from .stats_cache import get_mailing_stats, get_mailings_stats
+from .tasks import schedule_mailing_starts
 
 
 class ClientViewSet(viewsets.ModelViewSet):
     queryset = Client.objects.all()
     serializer_class = ClientSerializer
+    filter_lookups = {
+        "tag": "tag",
+        "mobile_operator_code": "mobile_operator_code",
+    }
+
+
+@method_decorator(transaction.non_atomic_requests, name="dispatch")
+class ClientImportView(GenericAPIView):
+    # The imported clients are written in batches committed one by one, so
+    # a huge upload holds no request-wide transaction, and the batches
+    # written before a malformed part of the body are kept and reported.
+    queryset = Client.objects.all()
+    serializer_class = ClientImportResultSerializer
+    pagination_class = None
+
+    @extend_schema(
+        request={content_type: ClientSerializer(many=True) for content_type in READERS},
+        parameters=[OpenApiParameter("upsert", bool)],
+        responses={
+            200: ClientImportResultSerializer,
+            400: ClientImportResultSerializer,
+        },
+    )
+    def post(self, request):
+        # The body is read as a stream instead of being parsed by DRF
+        read_rows = READERS.get(request.content_type.split(";")[0].strip())
+        if not read_rows:
+            raise UnsupportedMediaType(request.content_type)
+        importer = ClientImporter(upsert=request.query_params.get("upsert") == "true")
+        result = importer.execute(read_rows(request.stream or io.BytesIO()))
+        return Response(
+            self.get_serializer(result).data,
+            status=400 if result.format_error else 200,
+        )
+
+
+@method_decorator(transaction.non_atomic_requests, name="dispatch")
+class ClientBulkView(GenericAPIView):
+    # Updates or deletes all the clients matching the filters. The clients
+    # are changed in chunks committed one by one, hence no request-wide
+    # transaction.
+    queryset = Client.objects.all()
+    serializer_class = ClientBulkUpdateSerializer
+    pagination_class = None
+    filter_lookups = {
+        "tag": "tag",
+        "mobile_operator_code": "mobile_operator_code",
+        "timezone": "timezone",
+        "phone_number_prefix": "phone_number__startswith",
+    }
+
+    def get_bulk_mutation(self) -> ClientBulkMutation:
+        # A forgotten filter must not change every client
+        if not self.filter_lookups.keys() & self.request.query_params.keys():
+            raise ValidationError(
+                {"non_field_errors": ["At least one filter is required"]}
+            )
+        return ClientBulkMutation(self.filter_queryset(self.get_queryset()))
+
+    @extend_schema(
+        parameters=[OpenApiParameter(param, str) for param in filter_lookups],
+        responses=ClientBulkMutationResultSerializer,
+    )
+    def patch(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        result = self.get_bulk_mutation().update(serializer.validated_data)
+        return Response(ClientBulkMutationResultSerializer(result).data)
+
+    @extend_schema(
+        request=None,
+        parameters=[OpenApiParameter(param, str) for param in filter_lookups],
+        responses={200: ClientBulkMutationResultSerializer},
+    )
+    def delete(self, request):
+        result = self.get_bulk_mutation().delete()
+        return Response(ClientBulkMutationResultSerializer(result).data)
 
 
 class MailingViewSet(viewsets.ModelViewSet):
     queryset = Mailing.objects.all()
     serializer_class = MailingSerializer
+    filter_lookups = {
+        "tag": "tag",
+        "mobile_operator_code": "mobile_operator_code",
+        "start_at_after": "start_at__gte",
+        "start_at_before": "start_at__lt",
+    }
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        schedule_mailing_starts([serializer.instance.id])
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        schedule_mailing_starts([serializer.instance.id])
 
     @extend_schema(responses=MailingsStatsSerializer(many=False))
     @action(detail=False, methods=["get"])
     def stats(self, request):
         queryset = self.filter_queryset(self.get_queryset())
-        serializer = MailingsStatsSerializer(
-            {"message_statuses": queryset.stats(), "count": queryset.count()}
+        return Response(
+            get_mailings_stats(
+                query_params=dict(request.query_params.lists()),
+                compute=lambda: MailingsStatsSerializer(
+                    {"message_statuses": queryset.stats(), "count": queryset.count()}
+                ).data,
+            )
         )
-        return Response(serializer.data)
 
     @extend_schema(responses=MailingStatsSerializer(many=False))
     @action(detail=True, methods=["get"], url_path="stats")
     def detail_stats(self, request, pk):
-        serializer = MailingStatsSerializer(
-            {"message_statuses": self.get_queryset().filter(id=pk).stats()}
+        return Response(
+            get_mailing_stats(
+                mailing_id=pk,
+                compute=lambda: MailingStatsSerializer(
+                    {"message_statuses": self.get_queryset().filter(id=pk).stats()}
+                ).data,
+            )
+        )
+
+    @extend_schema(responses={(200, "application/octet-stream"): bytes})
+    @action(
+        detail=True,
+        methods=["get"],
+        url_path=r"messages\.(?P<export_format>ndjson|csv)(?P<compression>\.gz)?",
+    )
+    def export_messages(self, request, pk, export_format, compression=None):
+        mailing = self.get_object()
+        render, content_type = RENDERERS[export_format]
+        filename = f"mailing-{mailing.id}-messages.{export_format}"
+        if compression:
+            content_type, filename = "application/gzip", f"{filename}.gz"
+        return StreamingHttpResponse(
+            encode_chunks(
+                render(iter_mailing_messages(mailing.id)), compress=bool(compression)
+            ),
+            content_type=content_type,
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
         )
-        return Response(serializer.data)
 
 
 class MessageViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Message.objects.all()
     serializer_class = MessageSerializer
+    filter_lookups = {
+        "mailing": "mailing",
+        "client": "client",
+        "status": "status",
+        "created_at_after": "created_at__gte",
+        "created_at_before": "created_at__lt",
+    }
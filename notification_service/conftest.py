@@ -1,4 +1,6 @@
+import psycopg2.extensions
 import pytest
+from django.db import connection
 
 from notification_service.users.models import User
 from notification_service.users.tests.factories import UserFactory
@@ -12,3 +14,25 @@ def media_storage(settings, tmpdir):
 @pytest.fixture
 def user(db) -> User:
     return UserFactory()
+
+
+@pytest.fixture
+def transaction_pooling():
+    # Emulates pgbouncer in transaction pooling mode: every transaction,
+    # autocommitted statements included, may get another server session,
+    # so the session state is discarded before each of them
+    def discard_session_state(execute, sql, params, many, context):
+        raw_connection = context["connection"].connection
+        if (
+            raw_connection.get_transaction_status()
+            == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        ):
+            autocommit = raw_connection.autocommit
+            raw_connection.autocommit = True
+            with raw_connection.cursor() as cursor:
+                cursor.execute("DISCARD ALL")
+            raw_connection.autocommit = autocommit
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(discard_session_state):
+        yield
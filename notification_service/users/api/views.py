@@ -14,6 +14,8 @@ class UserViewSet(RetrieveModelMixin, ListModelMixin, UpdateModelMixin, GenericV
     serializer_class = UserSerializer
     queryset = User.objects.all()
     lookup_field = "username"
+    # Lists the current user only, a bare list as before the API pagination
+    pagination_class = None
 
     def get_queryset(self, *args, **kwargs):
         assert isinstance(self.request.user.id, int)
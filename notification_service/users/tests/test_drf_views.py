@@ -1,4 +1,5 @@
 from django.test import RequestFactory
+from rest_framework.test import force_authenticate
 
 from notification_service.users.api.views import UserViewSet
 from notification_service.users.models import User
@@ -28,3 +29,11 @@ class TestUserViewSet:
             "name": user.name,
             "url": f"http://testserver/api/users/{user.username}/",
         }
+
+    def test_list_is_not_paginated(self, user: User, rf: RequestFactory):
+        request = rf.get("/fake-url/")
+        force_authenticate(request, user=user)
+
+        response = UserViewSet.as_view({"get": "list"})(request)
+
+        assert [item["username"] for item in response.data] == [user.username]
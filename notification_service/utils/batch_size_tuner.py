@@ -0,0 +1,48 @@
+import logging
+
+
+class AdaptiveBatchSize:
+    # Sizes the batches of a DB round trip by its latency: a full batch done
+    # within half the target latency grows the size, a slower batch shrinks
+    # it in proportion to the overshoot. Partial batches tell nothing about
+    # a bigger size, so they never grow it.
+
+    def __init__(
+        self,
+        name: str,
+        initial_size: int,
+        min_size: int = 10,
+        max_size: int = 10000,
+        target_latency: float = 0.5,
+        growth_factor: float = 1.5,
+        min_decrease_factor: float = 0.5,
+    ):
+        self.name = name
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_latency = target_latency
+        self.growth_factor = growth_factor
+        self.min_decrease_factor = min_decrease_factor
+
+        self._size = float(min(max(initial_size, min_size), max_size))
+
+    @property
+    def size(self) -> int:
+        return int(self._size)
+
+    def _set_size(self, size: float):
+        previous_size = self.size
+        self._size = min(max(size, self.min_size), self.max_size)
+        if self.size != previous_size:
+            logging.info(
+                "Sender %s size changed: %s -> %s", self.name, previous_size, self.size
+            )
+
+    def observe(self, count: int, latency: float):
+        if latency > self.target_latency:
+            self._set_size(
+                self._size
+                * max(self.target_latency / latency, self.min_decrease_factor)
+            )
+        elif latency <= self.target_latency / 2 and count >= self.size:
+            self._set_size(self._size * self.growth_factor)
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import math
+import time
+from collections.abc import Callable
+from contextlib import asynccontextmanager
+
+
+class AdaptiveConcurrencyLimiter:
+    # AIMD concurrency window: it grows by one request per window of fast
+    # successful responses and is cut multiplicatively when the provider
+    # signals overload (429/503/timeouts), honouring its Retry-After.
+
+    def __init__(
+        self,
+        initial_window: int = 10,
+        min_window: int = 1,
+        max_window: int = 100,
+        decrease_factor: float = 0.5,
+        latency_tolerance: float = 2.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.min_window = min_window
+        self.max_window = max_window
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.clock = clock
+
+        self._window = float(initial_window)
+        self._in_flight = 0
+        self._condition: asyncio.Condition | None = None
+        self._condition_loop: asyncio.AbstractEventLoop | None = None
+        self._paused_until = 0.0
+        self._min_latency = math.inf
+        self._last_decrease_at = -math.inf
+
+    @property
+    def window(self) -> int:
+        return max(self.min_window, int(self._window))
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def _set_window(self, window: float):
+        previous_window = self.window
+        self._window = min(max(window, self.min_window), self.max_window)
+        if self.window != previous_window:
+            logging.info(
+                "Mailing concurrency window changed: %s -> %s",
+                previous_window,
+                self.window,
+            )
+
+    def on_success(self, latency: float):
+        self._min_latency = min(self._min_latency, latency)
+        if latency <= self._min_latency * self.latency_tolerance:
+            self._set_window(self._window + 1 / self._window)
+
+    def on_overload(
+        self, retry_after: float | None = None, started_at: float | None = None
+    ):
+        now = self.clock()
+        if retry_after:
+            self._paused_until = max(self._paused_until, now + retry_after)
+        # Requests sent before the last decrease saw the old window, so
+        # their failures do not shrink the window once more
+        if started_at is None or started_at >= self._last_decrease_at:
+            self._last_decrease_at = now
+            self._set_window(self._window * self.decrease_factor)
+
+    def _get_condition(self) -> asyncio.Condition:
+        # The limiter may outlive the event loop of a run, its window and
+        # pause carry over while the condition is bound to the current loop
+        loop = asyncio.get_running_loop()
+        if self._condition is None or self._condition_loop is not loop:
+            self._condition, self._condition_loop = asyncio.Condition(), loop
+        return self._condition
+
+    async def _wait_for_pause(self):
+        while (delay := self._paused_until - self.clock()) > 0:
+            await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def slot(self):
+        await self._wait_for_pause()
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self._in_flight < self.window)
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            async with condition:
+                self._in_flight -= 1
+                condition.notify_all()
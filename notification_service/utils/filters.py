@@ -0,0 +1,37 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import ForeignKey
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+
+class QueryParamsFilterBackend(BaseFilterBackend):
+    # Filters by the `filter_lookups` of a view, a mapping of query params
+    # to ORM lookups. The values are parsed by the filtered model fields.
+
+    def filter_queryset(self, request, queryset, view):
+        filters = {}
+        for param, lookup in getattr(view, "filter_lookups", {}).items():
+            value = request.query_params.get(param)
+            if value is None:
+                continue
+            field = queryset.model._meta.get_field(lookup.split("__")[0])
+            try:
+                value = field.to_python(value)
+                if not isinstance(field, ForeignKey):
+                    field.validate(value, model_instance=None)
+            except DjangoValidationError as e:
+                raise ValidationError({param: e.messages})
+            filters[lookup] = value
+        return queryset.filter(**filters)
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": param,
+                "required": False,
+                "in": "query",
+                "description": f"Filter by `{lookup}`",
+                "schema": {"type": "string"},
+            }
+            for param, lookup in getattr(view, "filter_lookups", {}).items()
+        ]
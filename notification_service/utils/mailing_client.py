@@ -1,14 +1,50 @@
 import asyncio
+import functools
 import logging
-from collections.abc import Iterable
-from contextlib import asynccontextmanager
+from collections.abc import Callable, Iterable
+from contextlib import AbstractAsyncContextManager, asynccontextmanager, nullcontext
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from enum import Enum
+from typing import cast
 
 import httpx
 from aiolimiter import AsyncLimiter
 
+from .concurrency_limiter import AdaptiveConcurrencyLimiter
+from .rate_limiter import BucketRateLimiter, RateLimiter
+
 GLOBAL_RATE_LIMITER = AsyncLimiter(max_rate=10, time_period=1)
 
+OVERLOAD_STATUS_CODES = (
+    httpx.codes.TOO_MANY_REQUESTS,
+    httpx.codes.SERVICE_UNAVAILABLE,
+)
+
+
+@functools.cache
+def _get_error_reporter() -> Callable[[BaseException], object] | None:
+    # Looked up once, not on every failed response
+    try:
+        from sentry import capture_exception
+    except ModuleNotFoundError:
+        return None
+    return capture_exception
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0)
+
 
 class MailingMessageStatus(str, Enum):
     PENDING = "Pending"
@@ -17,10 +53,15 @@ class MailingMessageStatus(str, Enum):
 
 
 class MailingMessage:
-    def __init__(self, msg_id: int, phone: str, text: str):
+    __slots__ = ("msg_id", "phone", "text", "operator_code", "status")
+
+    def __init__(
+        self, msg_id: int, phone: str, text: str, operator_code: str | None = None
+    ):
         self.msg_id = msg_id
         self.phone = phone
         self.text = text
+        self.operator_code = operator_code
         self.status: MailingMessageStatus = MailingMessageStatus.PENDING
 
 
@@ -43,18 +84,35 @@ class MailingClientApiException(BaseException):
 
 
 class MailingClient:
-    def __init__(self, token: str, rate_limiter: AsyncLimiter = None):
+    def __init__(
+        self,
+        token: str,
+        rate_limiter: RateLimiter | None = None,
+        limits: httpx.Limits | None = None,
+        http2: bool = False,
+        rate_limit_by_operator: bool = False,
+        concurrency_limiter: AdaptiveConcurrencyLimiter | None = None,
+        timeout: httpx.Timeout | None = None,
+    ):
         self._token = token
         self._root_url = "https://probe.fbrq.cloud"
         self._client: httpx.AsyncClient | None = None
-        self._rate_limiter: AsyncLimiter = rate_limiter or GLOBAL_RATE_LIMITER
+        self._rate_limiter: RateLimiter = rate_limiter or GLOBAL_RATE_LIMITER
+        self._limits = limits or httpx.Limits()
+        self._http2 = http2
+        # Requires a limiter supporting buckets, e.g. RedisTokenBucketLimiter
+        self._rate_limit_by_operator = rate_limit_by_operator
+        self._concurrency_limiter = concurrency_limiter
+        self._timeout = timeout or httpx.Timeout(10, connect=5)
 
     def _create_client(self):
         headers = {"authorization": f"Bearer {self._token}"}
         return httpx.AsyncClient(
             base_url=self._root_url,
             headers=headers,
-            # http2=True,
+            limits=self._limits,
+            http2=self._http2,
+            timeout=self._timeout,
         )
 
     @asynccontextmanager
@@ -71,6 +129,14 @@ class MailingClient:
                 await self._client.aclose()
                 self._client = None
 
+    @asynccontextmanager
+    async def _ensure_session(self):
+        if self._client:
+            yield
+        else:
+            async with self.session():
+                yield
+
     @asynccontextmanager
     async def _get_client(self) -> httpx.AsyncClient:
         if self._client:
@@ -84,52 +150,131 @@ class MailingClient:
                 if temp_client:
                     await temp_client.aclose()
 
-    async def _call_api(self, url: str, json: dict) -> httpx.Response:
-        async with self._rate_limiter:
-            async with self._get_client() as client:
-                response = await client.post(
-                    url,
-                    json=json,
-                )
-                return response
-
-    async def _raise_for_exception(
-        self, response: httpx.Response, silent: bool = False
-    ):
-        if response.is_success:
-            return
+    def _get_rate_limiter(self, message: MailingMessage) -> RateLimiter:
+        if self._rate_limit_by_operator and message.operator_code:
+            return cast(BucketRateLimiter, self._rate_limiter).bucket(
+                message.operator_code
+            )
+        return self._rate_limiter
 
+    @property
+    def concurrency_window(self) -> int | None:
+        if self._concurrency_limiter:
+            return self._concurrency_limiter.window
+        return None
+
+    @property
+    def max_concurrency(self) -> int | None:
+        # The adaptive window bounds the concurrent posts when configured
+        if self._concurrency_limiter:
+            return self._concurrency_limiter.max_window
+        return None
+
+    async def _post(self, client: httpx.AsyncClient, url: str, json: dict):
+        if not self._concurrency_limiter:
+            return await client.post(url, json=json)
+
+        started_at = self._concurrency_limiter.clock()
         try:
-            raise MailingClientApiException(http_resp=response)
-        except MailingClientApiException as e:
-            if not silent:
-                raise
-            logging.warning("Suppressed the mailing client exception", exc_info=e)
-            try:
-                from sentry import capture_exception
+            response = await client.post(url, json=json)
+        except httpx.TimeoutException:
+            self._concurrency_limiter.on_overload(started_at=started_at)
+            raise
 
-                capture_exception(e)
-            except ModuleNotFoundError:
-                pass
+        if response.status_code in OVERLOAD_STATUS_CODES:
+            self._concurrency_limiter.on_overload(
+                retry_after=parse_retry_after(response.headers.get("Retry-After")),
+                started_at=started_at,
+            )
+        elif response.is_success:
+            self._concurrency_limiter.on_success(
+                self._concurrency_limiter.clock() - started_at
+            )
+        return response
 
-    async def post_message(self, message: MailingMessage):
-        response = await self._call_api(
-            f"/v1/send/{message.msg_id}",
-            {
-                "id": message.msg_id,
-                "phone": message.phone,
-                "text": message.text,
-            },
+    async def _call_api(
+        self, url: str, json: dict, rate_limiter: RateLimiter | None = None
+    ) -> httpx.Response:
+        concurrency_slot = (
+            self._concurrency_limiter.slot()
+            if self._concurrency_limiter
+            else nullcontext()
         )
-        await self._raise_for_exception(response, silent=True)
+        async with concurrency_slot, rate_limiter or self._rate_limiter:
+            async with self._get_client() as client:
+                return await self._post(client, url, json)
+
+    @staticmethod
+    def _report_failed_response(response: httpx.Response):
+        # Failed responses are reported without raising: during an outage
+        # nearly every post fails, and raising, formatting tracebacks and
+        # import attempts per failure would dominate the CPU time
+        logging.warning(
+            "Failed to post a message: %s %s",
+            response.status_code,
+            response.reason_phrase,
+        )
+        if capture_exception := _get_error_reporter():
+            capture_exception(MailingClientApiException(http_resp=response))
+
+    async def post_message(self, message: MailingMessage):
+        try:
+            response = await self._call_api(
+                f"/v1/send/{message.msg_id}",
+                {
+                    "id": message.msg_id,
+                    "phone": message.phone,
+                    "text": message.text,
+                },
+                rate_limiter=self._get_rate_limiter(message),
+            )
+        except httpx.TransportError as e:
+            # Timeouts and broken connections fail only the message itself
+            logging.warning("Failed to post a message: %r", e)
+            message.status = MailingMessageStatus.FAILED
+            return message
+
         if response.is_success:
             message.status = MailingMessageStatus.SUCCEED
         else:
-            logging.warning("Failed to post a message!")
+            self._report_failed_response(response)
             message.status = MailingMessageStatus.FAILED
 
         return message
 
-    async def post_message_batch(self, messages: Iterable[MailingMessage]):
-        async with self.session():
-            await asyncio.gather(*[self.post_message(message) for message in messages])
+    async def post_message_batch(
+        self,
+        messages: Iterable[MailingMessage],
+        deadline: float | None = None,
+        concurrency: int | None = None,
+    ):
+        # Reuses the pooled connections of an already open session. Posts
+        # still outstanding after `deadline` seconds are cancelled and their
+        # messages are left PENDING, the finished ones keep their status.
+        # At most `concurrency` messages are posted at a time, unless the
+        # adaptive concurrency window bounds the posts instead.
+        semaphore: AbstractAsyncContextManager = nullcontext()
+        if concurrency and not self._concurrency_limiter:
+            semaphore = asyncio.Semaphore(concurrency)
+
+        async def post_message(message: MailingMessage):
+            async with semaphore:
+                return await self.post_message(message)
+
+        async with self._ensure_session():
+            tasks = [
+                asyncio.ensure_future(post_message(message)) for message in messages
+            ]
+            if not tasks:
+                return
+            done, pending = await asyncio.wait(tasks, timeout=deadline)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        if pending:
+            logging.warning(
+                "Cancelled %s message posts exceeding the batch deadline", len(pending)
+            )
+        for task in done:
+            task.result()
@@ -0,0 +1,10 @@
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    # Keyset pagination over the primary key: a page costs the same at any
+    # depth, needs no COUNT(*), and rows inserted meanwhile do not shift the
+    # following pages. Newest rows come first.
+    ordering = "-id"
+    page_size_query_param = "page_size"
+    max_page_size = 1000
@@ -0,0 +1,100 @@
+import asyncio
+from typing import Protocol
+
+from redis.asyncio import Redis
+
+# Refills the bucket according to the time passed since the last call and
+# takes the requested tokens if there are enough of them. Otherwise returns
+# how long the caller has to wait. The redis server clock is used, so all
+# the worker processes share the same notion of time.
+_ACQUIRE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local state = redis.call("HMGET", KEYS[1], "tokens", "updated_at")
+local tokens = tonumber(state[1]) or capacity
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+
+local wait = 0
+if tokens >= requested then
+    tokens = tokens - requested
+else
+    wait = (requested - tokens) / rate
+end
+
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated_at", tostring(now))
+redis.call("PEXPIRE", KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RateLimiter(Protocol):
+    # Entered before every request, e.g. aiolimiter.AsyncLimiter
+    async def __aenter__(self) -> object:
+        ...
+
+    async def __aexit__(self, exc_type, exc, tb) -> object:
+        ...
+
+
+class BucketRateLimiter(RateLimiter, Protocol):
+    # Also keeps separate limits by a bucket name
+    def bucket(self, bucket_name: str) -> RateLimiter:
+        ...
+
+
+class RedisTokenBucketLimiter:
+    # A drop-in replacement of aiolimiter.AsyncLimiter whose bucket lives in
+    # redis and is shared by every process using the same name.
+
+    def __init__(
+        self,
+        redis: Redis,
+        name: str,
+        max_rate: float,
+        time_period: float = 1,
+        capacity: float | None = None,
+    ):
+        self._redis = redis
+        self.name = name
+        self.max_rate = max_rate
+        self.time_period = time_period
+        self.capacity = capacity or max_rate
+        self._script = redis.register_script(_ACQUIRE_SCRIPT)
+
+    def bucket(self, bucket_name: str) -> "RedisTokenBucketLimiter":
+        return RedisTokenBucketLimiter(
+            redis=self._redis,
+            name=f"{self.name}:{bucket_name}",
+            max_rate=self.max_rate,
+            time_period=self.time_period,
+            capacity=self.capacity,
+        )
+
+    async def acquire(self, amount: float = 1):
+        while True:
+            wait = float(
+                await self._script(
+                    keys=[self.name],
+                    args=[self.max_rate / self.time_period, self.capacity, amount],
+                )
+            )
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    async def aclose(self):
+        # The connections are bound to the event loop they were opened in,
+        # so they are closed with it instead of being reused by later runs
+        await self._redis.close(close_connection_pool=True)
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return None
@@ -0,0 +1,89 @@
+import logging
+import threading
+import uuid
+from collections.abc import Callable
+
+from redis import Redis
+
+# The lease is only renewed or released by its holder
+_RENEW_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("PEXPIRE", KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+class RedisLease:
+    # Up to `slots` holders at a time. A holder keeps its slot alive with a
+    # heartbeat every third of the ttl; the slot of a crashed holder expires
+    # after the ttl.
+
+    def __init__(self, redis: Redis, name: str, ttl: float = 30, slots: int = 1):
+        self._redis = redis
+        self.name = name
+        self.ttl = ttl
+        self.slots = slots
+        self._token = uuid.uuid4().hex
+        self._key: str | None = None
+        self._stopped = threading.Event()
+        self._heartbeat: threading.Thread | None = None
+        self._renew_script = redis.register_script(_RENEW_SCRIPT)
+        self._release_script = redis.register_script(_RELEASE_SCRIPT)
+
+    @property
+    def skipped_count_key(self) -> str:
+        return f"{self.name}:skipped"
+
+    def acquire(self) -> bool:
+        for slot in range(self.slots):
+            key = f"{self.name}:{slot}"
+            if self._redis.set(key, self._token, nx=True, px=int(self.ttl * 1000)):
+                self._key = key
+                self._stopped.clear()
+                self._heartbeat = threading.Thread(target=self._renew, daemon=True)
+                self._heartbeat.start()
+                return True
+        return False
+
+    def _renew(self):
+        while not self._stopped.wait(self.ttl / 3):
+            try:
+                renewed = self._renew_script(
+                    keys=[self._key], args=[self._token, int(self.ttl * 1000)]
+                )
+            except Exception as e:
+                logging.warning("Failed to renew the %s lease: %r", self.name, e)
+                continue
+            if not renewed:
+                logging.warning("Lost the %s lease", self.name)
+                return
+
+    def release(self):
+        self._stopped.set()
+        if self._heartbeat:
+            self._heartbeat.join()
+        self._release_script(keys=[self._key], args=[self._token])
+        self._key = self._heartbeat = None
+
+    def run_exclusively(self, func: Callable, *args, **kwargs):
+        # Runs `func` if a slot is free, otherwise counts the skipped run
+        if not self.acquire():
+            skipped_count = self._redis.incr(self.skipped_count_key)
+            logging.info(
+                "Skipped %s: %d runs in progress, %d runs skipped so far",
+                self.name,
+                self.slots,
+                skipped_count,
+            )
+            return None
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.release()
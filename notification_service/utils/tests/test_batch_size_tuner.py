@@ -0,0 +1,44 @@
+from notification_service.utils.batch_size_tuner import AdaptiveBatchSize
+
+
+def _create_tuner(**kwargs) -> AdaptiveBatchSize:
+    return AdaptiveBatchSize("test", **{"initial_size": 100, **kwargs})
+
+
+def test_size_grows_on_fast_full_batches():
+    tuner = _create_tuner(target_latency=1, growth_factor=1.5)
+
+    tuner.observe(count=100, latency=0.6)
+    assert tuner.size == 100
+
+    tuner.observe(count=100, latency=0.5)
+    assert tuner.size == 150
+
+
+def test_size_does_not_grow_on_partial_batches():
+    tuner = _create_tuner(target_latency=1)
+
+    tuner.observe(count=99, latency=0.1)
+
+    assert tuner.size == 100
+
+
+def test_size_shrinks_in_proportion_to_the_overshoot():
+    tuner = _create_tuner(target_latency=1, min_decrease_factor=0.5)
+
+    tuner.observe(count=100, latency=1.25)
+    assert tuner.size == 80
+
+    tuner.observe(count=80, latency=10)
+    assert tuner.size == 40
+
+
+def test_size_is_bounded():
+    tuner = _create_tuner(min_size=50, max_size=120, target_latency=1)
+
+    tuner.observe(count=100, latency=0.1)
+    assert tuner.size == 120
+
+    for _ in range(3):
+        tuner.observe(count=tuner.size, latency=10)
+    assert tuner.size == 50
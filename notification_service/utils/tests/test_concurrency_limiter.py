@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+
+from notification_service.utils.concurrency_limiter import AdaptiveConcurrencyLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_window_grows_additively_on_fast_responses(clock):
+    limiter = AdaptiveConcurrencyLimiter(initial_window=4, clock=clock)
+
+    for _ in range(4):
+        limiter.on_success(latency=0.1)
+    assert limiter.window == 4
+
+    limiter.on_success(latency=0.1)
+    assert limiter.window == 5
+
+
+def test_window_does_not_grow_on_slow_responses(clock):
+    limiter = AdaptiveConcurrencyLimiter(
+        initial_window=4, latency_tolerance=2, clock=clock
+    )
+    limiter.on_success(latency=0.1)
+    window = limiter._window
+
+    limiter.on_success(latency=0.5)
+
+    assert limiter._window == window
+
+
+def test_window_shrinks_multiplicatively_once_per_sent_requests(clock):
+    limiter = AdaptiveConcurrencyLimiter(initial_window=16, clock=clock)
+    sent_at = clock.now
+
+    clock.now += 1
+    limiter.on_overload(started_at=sent_at)
+    limiter.on_overload(started_at=sent_at)
+    assert limiter.window == 8
+
+    sent_at = clock.now
+    clock.now += 1
+    limiter.on_overload(started_at=sent_at)
+    assert limiter.window == 4
+
+
+def test_window_is_bounded(clock):
+    limiter = AdaptiveConcurrencyLimiter(
+        initial_window=2, min_window=2, max_window=3, clock=clock
+    )
+
+    limiter.on_overload()
+    assert limiter.window == 2
+
+    for _ in range(20):
+        limiter.on_success(latency=0.1)
+    assert limiter.window == 3
+
+
+def test_slots_are_limited_by_window():
+    limiter = AdaptiveConcurrencyLimiter(initial_window=3)
+    max_in_flight = 0
+
+    async def request():
+        nonlocal max_in_flight
+        async with limiter.slot():
+            max_in_flight = max(max_in_flight, limiter.in_flight)
+            await asyncio.sleep(0.001)
+
+    async def run_requests():
+        await asyncio.gather(*[request() for _ in range(20)])
+
+    asyncio.run(run_requests())
+
+    assert max_in_flight == 3
+    assert limiter.in_flight == 0
+
+
+def test_retry_after_pauses_new_slots():
+    limiter = AdaptiveConcurrencyLimiter(initial_window=3)
+
+    async def acquire_after_overload() -> float:
+        loop = asyncio.get_running_loop()
+        limiter.on_overload(retry_after=0.05)
+        started_at = loop.time()
+        async with limiter.slot():
+            return loop.time() - started_at
+
+    assert asyncio.run(acquire_after_overload()) >= 0.04
+
+
+def test_limiter_is_reused_across_event_loops():
+    limiter = AdaptiveConcurrencyLimiter(initial_window=2)
+
+    async def request():
+        async with limiter.slot():
+            await asyncio.sleep(0.001)
+
+    async def run_requests():
+        await asyncio.gather(*[request() for _ in range(5)])
+
+    asyncio.run(run_requests())
+    limiter.on_overload()
+    asyncio.run(run_requests())
+
+    assert limiter.window == 1
+    assert limiter.in_flight == 0
@@ -0,0 +1,247 @@
+import asyncio
+
+import httpx
+import pytest
+from aiolimiter import AsyncLimiter
+
+from notification_service.utils import mailing_client as mailing_client_module
+from notification_service.utils.concurrency_limiter import AdaptiveConcurrencyLimiter
+from notification_service.utils.mailing_client import (
+    MailingClient,
+    MailingMessage,
+    MailingMessageStatus,
+    parse_retry_after,
+)
+
+
+class MockTransportMailingClient(MailingClient):
+    def __init__(self, handler, **kwargs):
+        super().__init__(
+            token="token",
+            rate_limiter=AsyncLimiter(max_rate=1000, time_period=1),
+            **kwargs,
+        )
+        self.handler = handler
+        self.created_clients = 0
+
+    def _create_client(self):
+        self.created_clients += 1
+        return httpx.AsyncClient(
+            base_url=self._root_url, transport=httpx.MockTransport(self.handler)
+        )
+
+
+def _make_messages(count: int) -> list[MailingMessage]:
+    return [
+        MailingMessage(msg_id=msg_id, phone="79000000000", text="text")
+        for msg_id in range(count)
+    ]
+
+
+@pytest.fixture
+def mailing_client():
+    return MockTransportMailingClient(lambda request: httpx.Response(200))
+
+
+def test_post_message_batch_reuses_active_session(mailing_client):
+    batches = [_make_messages(3), _make_messages(3)]
+
+    async def post_batches():
+        async with mailing_client.session():
+            for batch in batches:
+                await mailing_client.post_message_batch(batch)
+
+    asyncio.run(post_batches())
+
+    assert mailing_client.created_clients == 1
+    for batch in batches:
+        assert {message.status for message in batch} == {MailingMessageStatus.SUCCEED}
+
+
+def test_post_message_batch_opens_own_session(mailing_client):
+    messages = _make_messages(3)
+
+    asyncio.run(mailing_client.post_message_batch(messages))
+
+    assert mailing_client.created_clients == 1
+    assert {message.status for message in messages} == {MailingMessageStatus.SUCCEED}
+
+
+class RecordingLimiter:
+    def __init__(self, name: str = "", acquired: list | None = None):
+        self.name = name
+        self.acquired = [] if acquired is None else acquired
+
+    def bucket(self, bucket_name: str) -> "RecordingLimiter":
+        return RecordingLimiter(f"{self.name}:{bucket_name}", self.acquired)
+
+    async def __aenter__(self):
+        self.acquired.append(self.name)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return None
+
+
+@pytest.mark.parametrize(
+    "rate_limit_by_operator, expected_buckets",
+    [(False, ["", "", ""]), (True, [":123", ":456", ""])],
+)
+def test_post_message_rate_limit_buckets(rate_limit_by_operator, expected_buckets):
+    limiter = RecordingLimiter()
+    mailing_client = MockTransportMailingClient(
+        lambda request: httpx.Response(200),
+        rate_limit_by_operator=rate_limit_by_operator,
+    )
+    mailing_client._rate_limiter = limiter
+    messages = [
+        MailingMessage(msg_id=1, phone="79000000000", text="", operator_code="123"),
+        MailingMessage(msg_id=2, phone="79000000000", text="", operator_code="456"),
+        MailingMessage(msg_id=3, phone="79000000000", text=""),
+    ]
+
+    async def post_messages():
+        for message in messages:
+            await mailing_client.post_message(message)
+
+    asyncio.run(post_messages())
+
+    assert limiter.acquired == expected_buckets
+
+
+def test_adaptive_concurrency_reacts_to_overload():
+    async def handler(request):
+        await asyncio.sleep(0.01)
+        return httpx.Response(429, headers={"Retry-After": "0"})
+
+    concurrency_limiter = AdaptiveConcurrencyLimiter(initial_window=8)
+    mailing_client = MockTransportMailingClient(
+        handler, concurrency_limiter=concurrency_limiter
+    )
+    messages = _make_messages(3)
+
+    asyncio.run(mailing_client.post_message_batch(messages))
+
+    # The concurrent overloaded responses shrink the window once
+    assert mailing_client.concurrency_window == 4
+    assert {message.status for message in messages} == {MailingMessageStatus.FAILED}
+
+
+def test_transport_errors_fail_only_their_messages():
+    def handler(request):
+        if request.url.path == "/v1/send/0":
+            raise httpx.ReadTimeout("Timed out", request=request)
+        return httpx.Response(200)
+
+    mailing_client = MockTransportMailingClient(handler)
+    messages = _make_messages(3)
+
+    asyncio.run(mailing_client.post_message_batch(messages))
+
+    assert [message.status for message in messages] == [
+        MailingMessageStatus.FAILED,
+        MailingMessageStatus.SUCCEED,
+        MailingMessageStatus.SUCCEED,
+    ]
+
+
+def test_failed_responses_are_reported(monkeypatch):
+    reported_exceptions = []
+    monkeypatch.setattr(
+        mailing_client_module, "_get_error_reporter", lambda: reported_exceptions.append
+    )
+    mailing_client = MockTransportMailingClient(
+        lambda request: httpx.Response(500 if request.url.path == "/v1/send/0" else 200)
+    )
+    messages = _make_messages(2)
+
+    asyncio.run(mailing_client.post_message_batch(messages))
+
+    assert [message.status for message in messages] == [
+        MailingMessageStatus.FAILED,
+        MailingMessageStatus.SUCCEED,
+    ]
+    assert [exception.status for exception in reported_exceptions] == [500]
+
+
+def test_batch_deadline_cancels_outstanding_posts():
+    async def handler(request):
+        if request.url.path == "/v1/send/0":
+            await asyncio.sleep(10)
+        return httpx.Response(200)
+
+    mailing_client = MockTransportMailingClient(handler)
+    messages = _make_messages(3)
+
+    async def post_batch() -> float:
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        await mailing_client.post_message_batch(messages, deadline=0.05)
+        return loop.time() - started_at
+
+    assert asyncio.run(post_batch()) < 1
+    assert [message.status for message in messages] == [
+        MailingMessageStatus.PENDING,
+        MailingMessageStatus.SUCCEED,
+        MailingMessageStatus.SUCCEED,
+    ]
+
+
+def test_post_message_batch_limits_concurrency():
+    in_flight, max_in_flight = 0, 0
+
+    async def handler(request):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return httpx.Response(200)
+
+    mailing_client = MockTransportMailingClient(handler)
+    messages = _make_messages(10)
+
+    asyncio.run(mailing_client.post_message_batch(messages, concurrency=3))
+
+    assert max_in_flight == 3
+    assert {message.status for message in messages} == {MailingMessageStatus.SUCCEED}
+
+
+def test_adaptive_concurrency_window_bounds_the_batch_posts():
+    in_flight, max_in_flight = 0, 0
+
+    async def handler(request):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return httpx.Response(200)
+
+    concurrency_limiter = AdaptiveConcurrencyLimiter(initial_window=3)
+    mailing_client = MockTransportMailingClient(
+        handler, concurrency_limiter=concurrency_limiter
+    )
+    messages = _make_messages(60)
+
+    asyncio.run(mailing_client.post_message_batch(messages, concurrency=3))
+
+    # The window grows past the sender's concurrency and bounds the posts
+    assert concurrency_limiter.window > 3
+    assert max_in_flight > 3
+    assert max_in_flight <= concurrency_limiter.window
+    assert {message.status for message in messages} == {MailingMessageStatus.SUCCEED}
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        (None, None),
+        ("", None),
+        ("5", 5),
+        ("-1", 0),
+        ("Wed, 21 Oct 2015 07:28:00 GMT", 0),
+        ("garbage", None),
+    ],
+)
+def test_parse_retry_after(value, expected):
+    assert parse_retry_after(value) == expected
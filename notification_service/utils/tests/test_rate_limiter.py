@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+import pytest
+from fakeredis import FakeServer
+from fakeredis.aioredis import FakeRedis
+
+from notification_service.utils.rate_limiter import RedisTokenBucketLimiter
+
+MAX_RATE = 20
+
+
+@pytest.fixture
+def redis_server():
+    return FakeServer()
+
+
+def _create_limiter(redis_server: FakeServer) -> RedisTokenBucketLimiter:
+    # Every limiter gets its own connection, like a separate worker process
+    return RedisTokenBucketLimiter(
+        redis=FakeRedis(server=redis_server), name="test", max_rate=MAX_RATE
+    )
+
+
+async def _acquire_for(limiter, duration: float, acquired: list):
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        async with limiter:
+            acquired.append(time.monotonic())
+
+
+def _count_within(acquired: list, started_at: float, duration: float) -> int:
+    return len([moment for moment in acquired if moment - started_at <= duration])
+
+
+def test_aggregate_throughput_stays_under_the_cap(redis_server):
+    duration = 1
+    acquired = []
+    started_at = time.monotonic()
+
+    async def run_workers():
+        await asyncio.gather(
+            *[
+                _acquire_for(_create_limiter(redis_server), duration, acquired)
+                for _ in range(4)
+            ]
+        )
+
+    asyncio.run(run_workers())
+
+    # The initial burst is capped by the bucket capacity (MAX_RATE)
+    assert (
+        MAX_RATE
+        <= _count_within(acquired, started_at, duration)
+        <= MAX_RATE + MAX_RATE * duration + 1
+    )
+
+
+def test_buckets_are_limited_independently(redis_server):
+    limiter = _create_limiter(redis_server)
+    acquired = {"123": [], "456": []}
+    started_at = time.monotonic()
+
+    async def run_workers():
+        await asyncio.gather(
+            *[
+                _acquire_for(limiter.bucket(bucket_name), 0.3, bucket_acquired)
+                for bucket_name, bucket_acquired in acquired.items()
+            ]
+        )
+
+    asyncio.run(run_workers())
+
+    for bucket_acquired in acquired.values():
+        assert (
+            MAX_RATE
+            <= _count_within(bucket_acquired, started_at, 0.3)
+            <= MAX_RATE + MAX_RATE * 0.3 + 1
+        )
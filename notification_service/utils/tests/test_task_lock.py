@@ -0,0 +1,77 @@
+import time
+
+import pytest
+from fakeredis import FakeRedis, FakeServer
+
+from notification_service.utils.task_lock import RedisLease
+
+TTL = 0.3
+
+
+@pytest.fixture
+def redis_server():
+    return FakeServer()
+
+
+def _create_lease(redis_server: FakeServer, slots: int = 1) -> RedisLease:
+    # Every lease gets its own connection, like a separate worker process
+    return RedisLease(
+        redis=FakeRedis(server=redis_server), name="test", ttl=TTL, slots=slots
+    )
+
+
+@pytest.mark.parametrize("slots", [1, 2])
+def test_lease_is_held_by_a_bounded_number_of_holders(redis_server, slots):
+    leases = [_create_lease(redis_server, slots=slots) for _ in range(slots + 1)]
+
+    assert [lease.acquire() for lease in leases] == [True] * slots + [False]
+
+    leases[0].release()
+    assert leases[-1].acquire()
+    for lease in leases[1:]:
+        lease.release()
+
+
+def test_lease_is_renewed_while_held(redis_server):
+    holder, contender = _create_lease(redis_server), _create_lease(redis_server)
+
+    assert holder.acquire()
+    time.sleep(TTL * 3)
+    assert not contender.acquire()
+
+    holder.release()
+    assert contender.acquire()
+    contender.release()
+
+
+def test_lease_of_a_crashed_holder_expires(redis_server):
+    crashed_holder, contender = _create_lease(redis_server), _create_lease(redis_server)
+    assert crashed_holder.acquire()
+    # A crashed process does not renew its lease anymore
+    crashed_holder._stopped.set()
+    crashed_holder._heartbeat.join()
+
+    time.sleep(TTL * 1.5)
+    assert contender.acquire()
+
+    # The late release of the crashed holder keeps the new holder's lease
+    crashed_holder.release()
+    assert not _create_lease(redis_server).acquire()
+    contender.release()
+
+
+def test_overlapping_runs_are_skipped_and_counted(redis_server):
+    holder, contender = _create_lease(redis_server), _create_lease(redis_server)
+    calls = []
+
+    def run():
+        calls.append("holder")
+        for _ in range(2):
+            contender.run_exclusively(calls.append, "contender")
+        return "result"
+
+    assert holder.run_exclusively(run) == "result"
+    contender.run_exclusively(calls.append, "contender")
+
+    assert calls == ["holder", "contender"]
+    assert int(FakeRedis(server=redis_server).get(holder.skipped_count_key)) == 2